@@ -0,0 +1,272 @@
+"""离线压测：用本地替身接口和假 Context 驱动 MyPlugin 的定时发送链路。
+
+需要安装 AstrBot 运行环境（astrbot、aiohttp）。插件在临时目录中的 main.py 副本上运行，
+不会读写真实的 schedule.db 与图片缓存。
+
+示例:
+    python bench/bench_plugin.py --groups 10000 --hot-minutes 3 --send-latency-ms 30
+"""
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+PLUGIN_MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+
+class StandInUpstream:
+    def __init__(self, latency_ms, failure_rate, image_kb, rng):
+        self.latency = latency_ms / 1000
+        self.failure_rate = failure_rate
+        self.image = b'\xff\xd8' + os.urandom(max(image_kb * 1024 - 2, 0))
+        self.rng = rng
+        self.api_requests = 0
+        self.image_requests = 0
+        self.not_modified = 0
+        self.runner = None
+        self.port = None
+
+    async def handle_api(self, request):
+        self.api_requests += 1
+        await asyncio.sleep(self.latency)
+        if self.rng.random() < self.failure_rate:
+            return web.Response(status=503)
+        return web.json_response({"images": [{"path": f"http://127.0.0.1:{self.port}/image/briefing.jpg"}]})
+
+    async def handle_image(self, request):
+        self.image_requests += 1
+        await asyncio.sleep(self.latency)
+        if self.rng.random() < self.failure_rate:
+            return web.Response(status=503)
+        if request.headers.get('If-None-Match') == '"bench"':
+            self.not_modified += 1
+            return web.Response(status=304)
+        return web.Response(body=self.image, content_type='image/jpeg', headers={'ETag': '"bench"'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/60/', self.handle_api)
+        app.router.add_get('/image/briefing.jpg', self.handle_image)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/60/"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class FakeContext:
+    def __init__(self, latency_ms, error_rate, rng):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.rng = rng
+        self.clock = time.time
+        self.calls = 0
+        self.errors = 0
+        self.delivered = {}
+
+    async def send_message(self, session, message_chain):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise RuntimeError("模拟发送失败")
+        self.delivered.setdefault(session, self.clock())
+        return True
+
+
+class LoopMonitor:
+    def __init__(self, interval=0.01, threshold=0.05):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_block = 0.0
+        self.blocked_total = 0.0
+        self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            overshoot = loop.time() - start - self.interval
+            self.max_block = max(self.max_block, overshoot)
+            if overshoot > self.threshold:
+                self.blocked_total += overshoot
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        self.task.cancel()
+
+
+def load_plugin_module(work_dir):
+    # 插件的数据文件都放在 main.py 所在目录，复制一份避免污染真实数据
+    shutil.copy(PLUGIN_MAIN, os.path.join(work_dir, 'main.py'))
+    spec = importlib.util.spec_from_file_location('zxs60s_bench_main', os.path.join(work_dir, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_schedule(work_dir, groups, start_time, hot_minutes):
+    slots = [(start_time + datetime.timedelta(minutes=i)).strftime('%H:%M') for i in range(hot_minutes)]
+    conn = sqlite3.connect(os.path.join(work_dir, 'schedule.db'))
+    conn.execute(
+        "CREATE TABLE schedules ("
+        "group_id TEXT PRIMARY KEY, time TEXT, origin TEXT, updated_at REAL NOT NULL, task_id INTEGER)"
+    )
+    rows = []
+    for index in range(groups):
+        platform = 'aiocqhttp' if index % 4 else 'telegram'
+        origin = f"{platform}:GroupMessage:{index}"
+        rows.append((origin, slots[index % hot_minutes], origin, time.time(), index + 1))
+    conn.executemany("INSERT INTO schedules VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return {origin: slot for origin, slot, _, _, _ in rows}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run_benchmark(args):
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='zxs60s_bench_')
+    upstream = StandInUpstream(args.api_latency_ms, args.api_failure_rate, args.image_kb, rng)
+    api_url = await upstream.start()
+    module = load_plugin_module(work_dir)
+    tz = datetime.timezone(datetime.timedelta(hours=8))
+    start_time = datetime.datetime.combine(datetime.datetime.now(tz).date(), datetime.time.fromisoformat(args.start), tz)
+    targets = build_schedule(work_dir, args.groups, start_time, args.hot_minutes)
+
+    # 受控时钟：模拟时间 = 真实时间 + offset，每个热点分钟前把时钟拨到到点前 warp_lead 秒
+    clock_state = {'offset': 0.0}
+
+    def clock():
+        return time.time() + clock_state['offset']
+
+    def warp_to(ts):
+        clock_state['offset'] = ts - time.time()
+
+    warp_to(start_time.timestamp() - args.warp_lead)
+    context = FakeContext(args.send_latency_ms, args.send_error_rate, rng)
+    context.clock = clock
+    config = {
+        "enabled": True,
+        "send_concurrency": args.concurrency,
+        "send_rate_per_second": args.rate,
+        "send_burst": max(int(args.rate), 1),
+        "catchup_grace_minutes": 0,
+    }
+    monitor = LoopMonitor()
+    monitor.start()
+    load_start = time.perf_counter()
+    plugin = module.MyPlugin(context, config)
+    load_seconds = time.perf_counter() - load_start
+    plugin.zxs_api_url = api_url
+    plugin.clock = clock
+    init_start = time.perf_counter()
+    await plugin.initialize()
+    init_seconds = time.perf_counter() - init_start
+
+    expected = set(targets)
+    run_start = time.perf_counter()
+    for minute in range(args.hot_minutes):
+        fire_ts = start_time.timestamp() + minute * 60
+        warp_to(fire_ts - args.warp_lead)
+        plugin.notify_schedule_changed()
+        deadline = time.perf_counter() + args.timeout
+        slot = (start_time + datetime.timedelta(minutes=minute)).strftime('%H:%M')
+        due = {origin for origin, time_str in targets.items() if time_str == slot}
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+            if due <= context.delivered.keys():
+                break
+            if clock() >= fire_ts + 1 and not plugin.dispatch_tasks:
+                break
+    run_seconds = time.perf_counter() - run_start
+    monitor.stop()
+
+    lags = []
+    for origin, delivered_at in context.delivered.items():
+        slot = datetime.datetime.combine(start_time.date(), datetime.time.fromisoformat(targets[origin]), tz)
+        lags.append(delivered_at - slot.timestamp())
+    makespan = plugin.metrics.histograms.get(('batch_makespan_seconds', ()), {'sum': 0.0, 'max': 0.0, 'count': 0})
+    report = {
+        'groups': args.groups,
+        'hot_minutes': args.hot_minutes,
+        'plugin_load_seconds': round(load_seconds, 4),
+        'plugin_initialize_seconds': round(init_seconds, 4),
+        'run_seconds': round(run_seconds, 3),
+        'delivered': len(context.delivered),
+        'missing': len(expected - context.delivered.keys()),
+        'send_calls': context.calls,
+        'send_errors': context.errors,
+        'batches': makespan['count'],
+        'batch_makespan_max_seconds': round(makespan['max'], 3),
+        'fire_lag_p50_seconds': round(percentile(lags, 0.5), 3),
+        'fire_lag_p95_seconds': round(percentile(lags, 0.95), 3),
+        'fire_lag_p99_seconds': round(percentile(lags, 0.99), 3),
+        'fire_lag_max_seconds': round(max(lags) if lags else 0.0, 3),
+        'upstream_api_requests': upstream.api_requests,
+        'upstream_image_requests': upstream.image_requests,
+        'upstream_not_modified': upstream.not_modified,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'loop_block_max_seconds': round(monitor.max_block, 4),
+        'loop_block_total_seconds': round(monitor.blocked_total, 4),
+    }
+    await plugin.terminate()
+    await upstream.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="走小散每日简报插件离线压测")
+    parser.add_argument('--groups', type=int, default=10000, help="模拟群组数量")
+    parser.add_argument('--hot-minutes', type=int, default=3, help="群组平均分布到的热点分钟数")
+    parser.add_argument('--start', default='08:00', help="第一个热点分钟 (HH:MM)")
+    parser.add_argument('--api-latency-ms', type=float, default=50, help="替身接口与图片的响应延迟")
+    parser.add_argument('--api-failure-rate', type=float, default=0.0, help="替身接口返回 503 的概率")
+    parser.add_argument('--image-kb', type=int, default=800, help="替身简报图片大小")
+    parser.add_argument('--send-latency-ms', type=float, default=30, help="假 Context 每次发送的延迟")
+    parser.add_argument('--send-error-rate', type=float, default=0.0, help="假 Context 发送失败的概率")
+    parser.add_argument('--concurrency', type=int, default=50, help="插件的 send_concurrency")
+    parser.add_argument('--rate', type=float, default=0, help="插件的 send_rate_per_second，0 为不限速")
+    parser.add_argument('--warp-lead', type=float, default=5, help="每个热点分钟前把时钟拨到到点前多少秒")
+    parser.add_argument('--timeout', type=float, default=600, help="每个热点分钟最长等待的真实秒数")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="将结果额外写入该 JSON 文件")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key.ljust(width)}  {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report['missing'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,28 +3,659 @@ from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.api.message_components import *
 import json
+import csv
+import re
 import asyncio
 import datetime
 import aiohttp
 import os
+import time
+import heapq
+import bisect
+import itertools
+import hashlib
+import random
+import math
+import io
+import base64
 import tempfile
+import sqlite3
+import threading
+import socket
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+class Metrics:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def key(self, name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, labels=None, value=1):
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0, 'max': 0.0}
+        histogram['buckets'][bisect.bisect_left(self.BUCKETS, value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+        if value > histogram['max']:
+            histogram['max'] = value
+
+    def quantile(self, histogram, q):
+        # 按桶上界估算分位数，最后一个桶用观测到的最大值
+        rank = q * histogram['count']
+        seen = 0
+        for index, count in enumerate(histogram['buckets']):
+            seen += count
+            if seen >= rank and count:
+                return min(self.BUCKETS[index], histogram['max']) if index < len(self.BUCKETS) else histogram['max']
+        return histogram['max']
+
+    def format_labels(self, labels, extra=None):
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ''
+        return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+
+    def to_prometheus(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"zxs60s_{name}{self.format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                lines.append(f"zxs60s_{name}_bucket{self.format_labels(labels, ('le', bound))} {cumulative}")
+            lines.append(f"zxs60s_{name}_sum{self.format_labels(labels)} {histogram['sum']}")
+            lines.append(f"zxs60s_{name}_count{self.format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            self.probing = False
+        if self.state == 'half_open' and not self.probing:
+            # 半开状态只放行一个探测请求
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.state = 'closed'
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def get_retry_delay(self):
+        if self.state != 'open':
+            return 0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ScheduleStore:
+    # 已发送、已交给重试队列、已进入死信或已取消的发送都视为当天已处理，补发与多节点领取共用这一定义
+    DONE_STATUSES = ('sent', 'retrying', 'dead', 'cancelled')
+    DONE_SQL = "(" + ", ".join(f"'{status}'" for status in DONE_STATUSES) + ")"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # 单线程执行器保证写入按提交顺序落盘，且不阻塞事件循环
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='zxs60s-store')
+        self.conn = None
+
+    def open(self):
+        # 在存储线程中打开数据库，插件加载时不做任何磁盘操作
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS schedules ("
+            "group_id TEXT PRIMARY KEY, time TEXT, origin TEXT, updated_at REAL NOT NULL, task_id INTEGER)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(schedules)")]
+        if 'task_id' not in columns:
+            self.conn.execute("ALTER TABLE schedules ADD COLUMN task_id INTEGER")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            "group_id TEXT NOT NULL, day TEXT NOT NULL, slot TEXT, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, PRIMARY KEY (group_id, day))"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(deliveries)")]
+        if 'owner' not in columns:
+            self.conn.execute("ALTER TABLE deliveries ADD COLUMN owner TEXT")
+            self.conn.execute("ALTER TABLE deliveries ADD COLUMN lease_until REAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL, started_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS retry_queue ("
+            "group_id TEXT NOT NULL, day TEXT NOT NULL, kind TEXT NOT NULL, origin TEXT NOT NULL, slot TEXT, "
+            "attempts INTEGER NOT NULL, next_at REAL NOT NULL, last_error TEXT, created_at REAL NOT NULL, "
+            "PRIMARY KEY (group_id, day, kind))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS retry_queue_next_at ON retry_queue (next_at)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(retry_queue)")]
+        if 'owner' not in columns:
+            self.conn.execute("ALTER TABLE retry_queue ADD COLUMN owner TEXT")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, group_id TEXT NOT NULL, day TEXT NOT NULL, kind TEXT NOT NULL, "
+            "origin TEXT NOT NULL, slot TEXT, attempts INTEGER NOT NULL, last_error TEXT, failed_at REAL NOT NULL)"
+        )
+
+    def submit(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM schedules LIMIT 1").fetchone() is None
+
+    def load_all(self):
+        with self.lock:
+            return self.conn.execute("SELECT group_id, time, origin, task_id FROM schedules ORDER BY rowid").fetchall()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def bump_revision(self):
+        # 其他节点通过比较修订号得知定时任务被修改
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('schedule_revision', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value=value + 1"
+        )
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'schedule_revision'").fetchone()[0]
+
+    def bump_next_task_id(self, task_id):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('next_task_id', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=MAX(value, excluded.value)",
+            (task_id + 1,)
+        )
+
+    def upsert(self, group_id, time_str, origin, task_id):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO schedules (group_id, time, origin, updated_at, task_id) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(group_id) DO UPDATE SET time=excluded.time, origin=excluded.origin, "
+                "updated_at=excluded.updated_at, task_id=excluded.task_id",
+                (group_id, time_str, origin, time.time(), task_id)
+            )
+            if task_id is not None:
+                self.bump_next_task_id(task_id)
+            return self.bump_revision()
+
+    def delete(self, group_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM schedules WHERE group_id = ?", (group_id,))
+            self.conn.execute("DELETE FROM retry_queue WHERE group_id = ? AND kind = 'scheduled'", (group_id,))
+            return self.bump_revision()
+
+    def replace_all(self, rows):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM schedules")
+                self.conn.executemany(
+                    "INSERT INTO schedules (group_id, time, origin, updated_at, task_id) VALUES (?, ?, ?, ?, ?)",
+                    [(group_id, time_str, origin, now, task_id) for group_id, time_str, origin, task_id in rows]
+                )
+                task_ids = [row[3] for row in rows if row[3] is not None]
+                if task_ids:
+                    self.bump_next_task_id(max(task_ids))
+                revision = self.bump_revision()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return revision
+
+    def upsert_many(self, rows):
+        # 只写入变化的群组，不覆盖其他节点同时修改的任务
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO schedules (group_id, time, origin, updated_at, task_id) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(group_id) DO UPDATE SET time=excluded.time, origin=excluded.origin, "
+                    "updated_at=excluded.updated_at, task_id=excluded.task_id",
+                    [(group_id, time_str, origin, now, task_id) for group_id, time_str, origin, task_id in rows]
+                )
+                task_ids = [row[3] for row in rows if row[3] is not None]
+                if task_ids:
+                    self.bump_next_task_id(max(task_ids))
+                revision = self.bump_revision()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return revision
+
+    def record_delivery(self, group_id, day, slot, status, attempts):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO deliveries (group_id, day, slot, status, attempts, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(group_id, day) DO UPDATE SET slot=excluded.slot, status=excluded.status, "
+                "attempts=deliveries.attempts + excluded.attempts, updated_at=excluded.updated_at",
+                (group_id, day, slot, status, attempts, time.time())
+            )
+
+    def get_delivered_groups(self, day):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT group_id FROM deliveries WHERE day = ? AND status IN {self.DONE_SQL}", (day,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def enqueue_retry(self, group_id, day, kind, origin, slot, attempts, next_at, last_error):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO retry_queue (group_id, day, kind, origin, slot, attempts, next_at, last_error, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(group_id, day, kind) DO UPDATE SET "
+                "origin=excluded.origin, attempts=excluded.attempts, next_at=excluded.next_at, last_error=excluded.last_error, "
+                "owner=NULL",
+                (group_id, day, kind, origin, slot, attempts, next_at, last_error, time.time())
+            )
+
+    def claim_due_retries(self, now, limit, lease_until, owns, node_id, live_since):
+        # 领取时把 next_at 推迟到租约到期并记录领取节点，领取节点存活期间由心跳续约，
+        # 节点退出后条目在租约到期时重新出现
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT group_id, day, kind, origin, slot, attempts, last_error, created_at FROM retry_queue "
+                "WHERE next_at <= ? AND (owner IS NULL OR owner = ? OR owner NOT IN "
+                "(SELECT node_id FROM nodes WHERE heartbeat_at >= ?)) ORDER BY next_at LIMIT ?",
+                (now, node_id, live_since, limit)
+            ).fetchall()
+            claimed = []
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    if not owns(row[0]):
+                        continue
+                    cursor = self.conn.execute(
+                        "UPDATE retry_queue SET next_at = ?, owner = ? WHERE group_id = ? AND day = ? AND kind = ? AND next_at <= ?",
+                        (lease_until, node_id, row[0], row[1], row[2], now)
+                    )
+                    if cursor.rowcount:
+                        claimed.append(row)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return claimed, len(rows)
+
+    def release_retries(self, node_id):
+        with self.lock:
+            self.conn.execute("UPDATE retry_queue SET owner = NULL WHERE owner = ?", (node_id,))
+
+    def get_next_retry_at(self):
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(next_at) FROM retry_queue").fetchone()
+        return row[0] if row else None
+
+    def count_retries(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM retry_queue").fetchone()[0]
+
+    def delete_retry(self, group_id, day, kind):
+        with self.lock:
+            self.conn.execute("DELETE FROM retry_queue WHERE group_id = ? AND day = ? AND kind = ?", (group_id, day, kind))
+
+    def move_to_dead_letter(self, group_id, day, kind, origin, slot, attempts, last_error):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM retry_queue WHERE group_id = ? AND day = ? AND kind = ?", (group_id, day, kind))
+                self.conn.execute(
+                    "INSERT INTO dead_letters (group_id, day, kind, origin, slot, attempts, last_error, failed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (group_id, day, kind, origin, slot, attempts, last_error, time.time())
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def list_dead_letters(self, offset, limit):
+        with self.lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT id, group_id, day, kind, slot, attempts, last_error, failed_at FROM dead_letters "
+                "ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return total, rows
+
+    def clear_dead_letters(self):
+        with self.lock:
+            return self.conn.execute("DELETE FROM dead_letters").rowcount
+
+    def claim_deliveries(self, day, rows, node_id, now, lease_until, live_since):
+        # 未记录、或领取节点已离线且租约过期的 (群组, 日期) 才能被领取，保证多个节点中只有一个发送；
+        # 领取节点存活期间租约由心跳续期，批次发送再久也不会被其他节点抢走
+        claimed = set()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for group_id, slot in rows:
+                    cursor = self.conn.execute(
+                        "INSERT INTO deliveries (group_id, day, slot, status, attempts, updated_at, owner, lease_until) "
+                        "VALUES (?, ?, ?, 'claimed', 0, ?, ?, ?) ON CONFLICT(group_id, day) DO UPDATE SET "
+                        "slot=excluded.slot, status='claimed', updated_at=excluded.updated_at, owner=excluded.owner, "
+                        f"lease_until=excluded.lease_until WHERE deliveries.status NOT IN {self.DONE_SQL} AND "
+                        "(deliveries.owner IS NULL OR deliveries.owner = excluded.owner OR "
+                        "((deliveries.lease_until IS NULL OR deliveries.lease_until < ?) AND deliveries.owner NOT IN "
+                        "(SELECT node_id FROM nodes WHERE heartbeat_at >= ?)))",
+                        (group_id, day, slot, now, node_id, lease_until, now, live_since)
+                    )
+                    if cursor.rowcount:
+                        claimed.add(group_id)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def heartbeat(self, node_id, now, ttl):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO nodes (node_id, heartbeat_at, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(node_id) DO UPDATE SET heartbeat_at=excluded.heartbeat_at",
+                (node_id, now, now)
+            )
+            # 续期本节点仍在发送中的领取
+            self.conn.execute(
+                "UPDATE deliveries SET lease_until = ? WHERE owner = ? AND status = 'claimed'", (now + ttl, node_id)
+            )
+            self.conn.execute("UPDATE retry_queue SET next_at = ? WHERE owner = ?", (now + ttl, node_id))
+            self.conn.execute("DELETE FROM nodes WHERE heartbeat_at < ?", (now - ttl * 10,))
+            rows = self.conn.execute("SELECT node_id FROM nodes WHERE heartbeat_at >= ?", (now - ttl,)).fetchall()
+            revision = self.conn.execute("SELECT value FROM meta WHERE key = 'schedule_revision'").fetchone()
+        return [row[0] for row in rows], revision[0] if revision else 0
+
+    def remove_node(self, node_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+
+    def prune_deliveries(self, before_day):
+        with self.lock:
+            return self.conn.execute("DELETE FROM deliveries WHERE day < ?", (before_day,)).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=64):
+        self.nodes = sorted(set(nodes))
+        # 每个节点放置多个虚拟节点，节点增减时只迁移相邻区间的群组
+        self.ring = sorted((self.hash_key(f"{node}#{index}"), node) for node in self.nodes for index in range(replicas))
+        self.keys = [key for key, _ in self.ring]
+
+    def hash_key(self, key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get_node(self, key):
+        if not self.ring:
+            return None
+        return self.ring[bisect.bisect(self.keys, self.hash_key(key)) % len(self.ring)][1]
+
+
+class TaskRegistry:
+    def __init__(self):
+        self.clear()
+
+    def clear(self, next_id=1):
+        self.next_id = next_id
+        self.task_ids = {}
+        self.group_ids = {}
+        self.entries = {}
+        # 活跃任务按 (一天中的分钟数, 任务ID) 有序保存，列出时从当前时刻旋转即为按下次发送时间排序
+        self.active_order = []
+        self.inactive_order = []
+
+    def get_minute(self, time_str):
+        try:
+            hour, minute = map(int, time_str.split(':'))
+            return hour * 60 + minute
+        except (AttributeError, ValueError):
+            return None
+
+    def remove(self, group_id):
+        task_id = self.task_ids.pop(group_id, None)
+        if task_id is None:
+            return None
+        del self.group_ids[task_id]
+        key = self.entries.pop(task_id)
+        order = self.active_order if key[0] is not None else self.inactive_order
+        index = bisect.bisect_left(order, key[1])
+        if index < len(order) and order[index] == key[1]:
+            del order[index]
+        return task_id
+
+    def update(self, group_id, time_str, active, task_id=None):
+        current_id = self.remove(group_id)
+        if current_id is not None:
+            task_id = current_id
+        if task_id is None or task_id in self.group_ids:
+            task_id = self.next_id
+        self.next_id = max(self.next_id, task_id + 1)
+        minute = self.get_minute(time_str) if active else None
+        if active and minute is not None:
+            key = (minute, (minute, task_id))
+            bisect.insort(self.active_order, key[1])
+        else:
+            key = (None, task_id)
+            bisect.insort(self.inactive_order, task_id)
+        self.task_ids[group_id] = task_id
+        self.group_ids[task_id] = group_id
+        self.entries[task_id] = key
+        return task_id
+
+    def get_group_id(self, task_id):
+        return self.group_ids.get(task_id)
+
+    def get_task_id(self, group_id):
+        return self.task_ids.get(group_id)
+
+    def is_active(self, task_id):
+        entry = self.entries.get(task_id)
+        return entry is not None and entry[0] is not None
+
+    def list_active(self, now, offset, limit):
+        # 当前分钟已过的部分排到明天
+        now_minute = now.hour * 60 + now.minute + (1 if now.second or now.microsecond else 0)
+        start = bisect.bisect_left(self.active_order, (now_minute, 0))
+        total = len(self.active_order)
+        return [self.active_order[(start + i) % total][1] for i in range(offset, min(offset + limit, total))]
+
+    def list_inactive(self, offset, limit):
+        return self.inactive_order[offset:offset + limit]
+
 
 @register("zxs60s", "egg", "今日简报插件，支持定时发送", "2.0.0")
 class MyPlugin(Star):
     def __init__(self, context: Context, config: dict):
         super().__init__(context)
         self.enabled = config.get("enabled", True)
-        self.temp_dir = tempfile.mkdtemp()
         self.config = config
         self.zxs_api_url = "https://know.zousanzy.cn/60/"
         self.user_custom_timezone = ZoneInfo('Asia/Shanghai')
         self.group_schedules = {}
+        self.clock = time.time
+        self.schedule_heap = []
+        self.next_fire = {}
+        self.heap_seq = itertools.count()
+        self.schedule_changed = asyncio.Event()
+        self.prefetch_wakeup = asyncio.Event()
+        self.prefetch_lead_seconds = max(int(config.get("prefetch_lead_seconds", 120)), 0)
+        self.warm_state = {'status': 'idle', 'fire_ts': None, 'attempts': 0, 'error': None}
+        self.send_semaphore = asyncio.Semaphore(max(int(config.get("send_concurrency", 10)), 1))
+        self.send_rate = float(config.get("send_rate_per_second", 5))
+        self.send_burst = max(int(config.get("send_burst", 5)), 1)
+        self.platform_send_rates = self.parse_platform_rates(config.get("send_platform_rates", []))
+        self.rate_limiters = {}
+        self.dispatch_tasks = set()
+        self.metrics = Metrics()
+        self.media_base64_platforms = set(config.get("media_base64_platforms", ["aiocqhttp", "satori", "webchat", "wecom_ai_bot"]) or [])
+        self.media_url_platforms = set(config.get("media_url_platforms", []) or [])
+        self.media_cache = {}
+        self.media_lock = asyncio.Lock()
+        self.image_variant_rules = self.parse_variant_rules(config.get("image_variants", []))
+        self.image_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='zxs60s-image')
+        self.variant_tasks = {}
+        self.metrics_file = str(config.get("metrics_file", "") or "").strip()
+        self.metrics_dump_interval = max(int(config.get("metrics_dump_interval", 60)), 5)
+        self.inflight_deliveries = set()
+        self.retry_max_attempts = max(int(config.get("retry_max_attempts", 6)), 1)
+        self.retry_base_delay = max(float(config.get("retry_base_delay", 10)), 1)
+        self.retry_max_delay = max(float(config.get("retry_max_delay", 600)), self.retry_base_delay)
+        self.retry_horizon_seconds = max(float(config.get("retry_horizon_minutes", 180)), 1) * 60
+        self.retry_wakeup = asyncio.Event()
+        self.ledger_retention_days = max(int(config.get("ledger_retention_days", 30)), 1)
+        self.ledger_pruned_day = None
+        self.catchup_grace_seconds = max(int(config.get("catchup_grace_minutes", 30)), 0) * 60
         plugin_dir = os.path.dirname(os.path.abspath(__file__))
         self.schedule_file = os.path.join(plugin_dir, 'schedule.json')
-        self.load_schedule()
-        asyncio.get_event_loop().create_task(self.scheduled_task()) 
-        
+        self.schedule_store = ScheduleStore(os.path.join(plugin_dir, 'schedule.db'))
+        self.task_registry = TaskRegistry()
+        self.doc_page_size = max(int(config.get("doc_page_size", 20)), 1)
+        self.export_dir = os.path.join(plugin_dir, 'export')
+        self.cache_dir = os.path.join(plugin_dir, 'cache')
+        self.cache_index_file = os.path.join(self.cache_dir, 'index.json')
+        self.cache_revalidate_seconds = max(int(config.get("cache_revalidate_minutes", 30)), 0) * 60
+        # 预取的图片到发送时必须仍在校验有效期内，否则发送时还会访问上游；不做校验缓存时预取没有意义
+        self.prefetch_lead_seconds = min(self.prefetch_lead_seconds, self.cache_revalidate_seconds)
+        self.cache_max_days = max(int(config.get("cache_max_days", 7)), 1)
+        self.cache_max_bytes = max(int(config.get("cache_max_mb", 50)), 1) * 1024 * 1024
+        self.image_cache = {}
+        self.image_max_bytes = max(float(config.get("image_max_mb", 20)), 0.1) * 1024 * 1024
+        self.http_timeout = aiohttp.ClientTimeout(
+            total=float(config.get("http_total_timeout", 30)),
+            connect=float(config.get("http_connect_timeout", 5)),
+            sock_read=float(config.get("http_read_timeout", 15))
+        )
+        self.http_pool_limit = max(int(config.get("http_pool_limit", 20)), 1)
+        self.http_dns_cache_ttl = max(int(config.get("http_dns_cache_ttl", 300)), 0)
+        self.http_session = None
+        self.fetch_deadline = max(float(config.get("fetch_deadline_seconds", 20)), 1)
+        self.upstream_breaker = CircuitBreaker(
+            int(config.get("breaker_failure_threshold", 3)),
+            max(float(config.get("breaker_reset_seconds", 60)), 1)
+        )
+        self.stale_mode = config.get("stale_mode", "notice")
+        self.stale_max_days = max(int(config.get("stale_max_days", 1)), 0)
+        self.stale_notice = config.get("stale_notice", "今日简报暂未更新，以下为 {day} 的简报")
+        self.refresh_task = None
+        self.refresh_inflight = {}
+        self.test_cooldown = max(float(config.get("test_cooldown_seconds", 60)), 0)
+        self.test_global_cooldown = max(float(config.get("test_global_cooldown_seconds", 5)), 0)
+        self.test_last_run = {}
+        self.test_global_last_run = None
+        self.shutdown_drain_seconds = max(float(config.get("shutdown_drain_seconds", 10)), 0)
+        self.cluster_mode = bool(config.get("cluster_mode", False))
+        self.node_id = str(config.get("node_id", "") or "").strip() or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = max(float(config.get("lease_ttl_seconds", 30)), 3)
+        self.shard_ring = HashRing([self.node_id])
+        self.schedule_revision = None
+        self.background_tasks = set()
+        self.started = False
+        self.stopping = False
+
+    async def initialize(self):
+        # 加载数据与后台任务都放在启动钩子中，插件加载耗时与任务数量无关
+        if self.started:
+            return
+        self.started = True
+        try:
+            await self.schedule_store.submit(self.schedule_store.open)
+            await asyncio.get_running_loop().run_in_executor(self.image_executor, self.load_image_cache)
+        except Exception as e:
+            logger.error(f"初始化插件数据失败: {e}")
+            import traceback
+            logger.error(f"错误详情: {traceback.format_exc()}")
+            return
+        if self.cluster_mode:
+            # 先登记节点并取得存活节点列表，调度器启动时即按分片过滤
+            await self.update_cluster()
+        await self.load_schedule()
+        if self.cluster_mode:
+            self.start_background(self.cluster_task())
+        self.start_background(self.scheduled_task())
+        self.start_background(self.catch_up_missed())
+        self.start_background(self.retry_worker())
+        self.start_background(self.prefetch_task())
+        if self.metrics_file:
+            self.start_background(self.metrics_dump_task())
+
+    def start_background(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
     def get_group_id(self, message_target):
         try:
             return str(message_target)
@@ -36,60 +667,102 @@ class MyPlugin(Star):
             return None
         return origin if isinstance(origin, str) else str(origin)
 
-    def load_schedule(self):
+    def read_schedule_json(self):
+        schedules = {}
+        with open(self.schedule_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            if 'group_schedules' in data:
+                for group_id, schedule_info in data.get('group_schedules', {}).items():
+                    schedules[group_id] = {
+                        'time': schedule_info.get('time'),
+                        'origin': schedule_info.get('origin')
+                    }
+            else:
+                old_time = data.get('user_custom_time')
+                old_target = data.get('message_target')
+                if old_time and old_target:
+                    group_id = self.get_group_id(old_target)
+                    schedules[group_id] = {
+                        'time': old_time,
+                        'origin': None
+                    }
+        return schedules
+
+    def migrate_schedule_json(self):
+        schedules = self.read_schedule_json()
+        self.schedule_store.replace_all(
+            [(group_id, info['time'], info['origin'], task_id) for task_id, (group_id, info) in enumerate(schedules.items(), 1)]
+        )
+        os.replace(self.schedule_file, self.schedule_file + '.migrated')
+        logger.info(f"已将 {len(schedules)} 个定时任务从 schedule.json 迁移到 schedule.db")
+
+    def read_schedule_rows(self):
+        # 在存储线程中执行：必要时迁移旧版 schedule.json，并读出全部任务
+        if os.path.exists(self.schedule_file) and self.schedule_store.is_empty():
+            self.migrate_schedule_json()
+        return self.schedule_store.load_all(), self.schedule_store.get_meta('next_task_id', 1)
+
+    async def load_schedule(self):
         if not self.enabled:
             return
-        if os.path.exists(self.schedule_file):
-            try:
-                with open(self.schedule_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if 'group_schedules' in data:
-                        schedules = data.get('group_schedules', {})
-                        self.group_schedules = {}
-                        for group_id, schedule_info in schedules.items():
-                            time_str = schedule_info.get('time')
-                            origin_str = schedule_info.get('origin')
-                            target = origin_str if origin_str else None
-                            self.group_schedules[group_id] = {
-                                'time': time_str,
-                                'target': target,
-                                'origin': origin_str
-                            }
-                    else:
-                        old_time = data.get('user_custom_time')
-                        old_target = data.get('message_target')
-                        if old_time and old_target:
-                            group_id = self.get_group_id(old_target)
-                            self.group_schedules = {
-                                group_id: {
-                                    'time': old_time,
-                                    'target': None,
-                                    'origin': None
-                                }
-                            }
-            except Exception as e:
-                logger.error(f"加载定时任务信息失败: {e}")
-                import traceback
-                logger.error(f"错误详情: {traceback.format_exc()}")
+        try:
+            rows, next_task_id = await self.schedule_store.submit(self.read_schedule_rows)
+            self.group_schedules = {}
+            self.task_registry.clear(next_task_id)
+            unnumbered = []
+            for group_id, time_str, origin_str, task_id in rows:
+                target = origin_str if origin_str else None
+                self.group_schedules[group_id] = {
+                    'time': time_str,
+                    'target': target,
+                    'origin': origin_str
+                }
+                if task_id is None:
+                    unnumbered.append(group_id)
+                else:
+                    self.task_registry.update(group_id, time_str, bool(target), task_id)
+            # 旧版数据库中的任务按原有顺序补发任务ID
+            for group_id in unnumbered:
+                schedule_info = self.group_schedules[group_id]
+                self.task_registry.update(group_id, schedule_info['time'], bool(schedule_info['target']))
+            if unnumbered:
+                await self.save_groups(unnumbered)
+        except Exception as e:
+            logger.error(f"加载定时任务信息失败: {e}")
+            import traceback
+            logger.error(f"错误详情: {traceback.format_exc()}")
+        self.rebuild_schedule_heap()
 
-    def save_schedule(self):
-        schedules_to_save = {}
-        for group_id, schedule_info in self.group_schedules.items():
-            item = {'time': schedule_info.get('time')}
-            origin = schedule_info.get('origin') or (self.get_origin_str(schedule_info.get('target')) if schedule_info.get('target') else None)
-            if origin:
-                item['origin'] = origin
-            schedules_to_save[group_id] = item
-        data = {'group_schedules': schedules_to_save}
+    def get_schedule_row(self, group_id, schedule_info):
+        origin = schedule_info.get('origin') or (self.get_origin_str(schedule_info.get('target')) if schedule_info.get('target') else None)
+        return group_id, schedule_info.get('time'), origin, self.task_registry.get_task_id(group_id)
+
+    async def persist_group(self, group_id):
+        schedule_info = self.group_schedules.get(group_id)
+        try:
+            if schedule_info is None:
+                revision = await self.schedule_store.submit(self.schedule_store.delete, group_id)
+            else:
+                revision = await self.schedule_store.submit(self.schedule_store.upsert, *self.get_schedule_row(group_id, schedule_info))
+            self.note_own_revision(revision)
+        except Exception as e:
+            logger.error(f"保存定时任务信息失败: {e}")
+            import traceback
+            logger.error(f"错误详情: {traceback.format_exc()}")
+
+    async def save_groups(self, group_ids):
+        rows = [self.get_schedule_row(group_id, self.group_schedules[group_id]) for group_id in group_ids]
         try:
-            with open(self.schedule_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            revision = await self.schedule_store.submit(self.schedule_store.upsert_many, rows)
+            self.note_own_revision(revision)
         except Exception as e:
             logger.error(f"保存定时任务信息失败: {e}")
             import traceback
             logger.error(f"错误详情: {traceback.format_exc()}")
 
     async def get_zxs_image_url(self, session):
+        start = time.perf_counter()
+        result = 'error'
         try:
             async with session.get(self.zxs_api_url) as response:
                 if response.status == 200:
@@ -99,32 +772,279 @@ class MyPlugin(Star):
                         if images and len(images) > 0:
                             image_path = images[0].get("path", "")
                             if image_path:
+                                result = 'ok'
                                 return image_path
                 return None
-        except (aiohttp.ClientError, json.JSONDecodeError, KeyError) as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError, KeyError) as e:
             logger.error(f"获取今日简报图片URL失败: {e}")
             return None
+        finally:
+            self.metrics.inc('api_requests_total', {'result': result})
+            self.metrics.observe('api_request_seconds', time.perf_counter() - start)
     
-    async def get_zxs_image(self):
+    def load_image_cache(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.part'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
+        if not os.path.exists(self.cache_index_file):
+            return
         try:
-            async with aiohttp.ClientSession() as session:
-                image_url = await self.get_zxs_image_url(session)
-                if image_url:
-                    try:
-                        async with session.get(image_url) as res:
-                            if res.status == 200:
-                                image_data = await res.read()
-                                temp_path = os.path.join(self.temp_dir, 'zxs60s.jpg')
-                                with open(temp_path, 'wb') as f:
-                                    f.write(image_data)
-                                return temp_path
-                    except Exception as e:
-                        logger.error(f"下载今日简报图片失败: {e}")
-                        return image_url
-                return None
+            with open(self.cache_index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.image_cache = {
+                day: entry for day, entry in data.get('days', {}).items()
+                if os.path.exists(os.path.join(self.cache_dir, entry.get('file', '')))
+            }
+        except Exception as e:
+            logger.error(f"加载简报图片缓存索引失败: {e}")
+            self.image_cache = {}
+
+    def save_image_cache(self):
+        temp_file = self.cache_index_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'days': self.image_cache}, f, ensure_ascii=False)
+            os.replace(temp_file, self.cache_index_file)
+        except Exception as e:
+            logger.error(f"保存简报图片缓存索引失败: {e}")
+
+    def evict_image_cache(self, today):
+        oldest_day = (datetime.date.fromisoformat(today) - datetime.timedelta(days=self.cache_max_days - 1)).isoformat()
+        total_size = sum(entry.get('size', 0) for entry in self.image_cache.values())
+        for day in sorted(self.image_cache):
+            if day == today:
+                continue
+            if day >= oldest_day and total_size <= self.cache_max_bytes:
+                continue
+            entry = self.image_cache.pop(day)
+            total_size -= entry.get('size', 0)
+            # 按日期前缀清理，同一天内因图片链接变化留下的旧文件及其变体也一并删除
+            self.remove_cache_files(f"zxs60s_{day}_")
+            logger.info(f"已清理 {day} 的简报图片缓存")
+
+    def remove_cache_files(self, prefix):
+        self.variant_tasks = {
+            path: task for path, task in self.variant_tasks.items()
+            if not os.path.basename(path).startswith(prefix)
+        }
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
+
+    def write_chunk(self, f, chunk):
+        f.write(chunk)
+
+    def finish_file(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    async def download_image(self, res, image_path):
+        content_type = res.headers.get('Content-Type', '')
+        if content_type and not content_type.lower().startswith('image/'):
+            raise ValueError(f"响应不是图片: {content_type}")
+        if res.content_length and res.content_length > self.image_max_bytes:
+            raise ValueError(f"图片大小 {res.content_length} 字节超过上限")
+        # 先写入同目录临时文件，fsync 后原子替换，并发读取方不会读到半个文件
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        f = os.fdopen(fd, 'wb')
+        size = 0
+        try:
+            async for chunk in res.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > self.image_max_bytes:
+                    raise ValueError(f"图片大小超过上限 {self.image_max_bytes:.0f} 字节")
+                await asyncio.to_thread(self.write_chunk, f, chunk)
+            await asyncio.to_thread(self.finish_file, f)
+            os.replace(temp_path, image_path)
+        except BaseException:
+            f.close()
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return size
+
+    def get_http_session(self):
+        if self.http_session is None or self.http_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.http_pool_limit,
+                limit_per_host=self.http_pool_limit,
+                ttl_dns_cache=self.http_dns_cache_ttl,
+                use_dns_cache=self.http_dns_cache_ttl > 0,
+                keepalive_timeout=60
+            )
+            self.http_session = aiohttp.ClientSession(connector=connector, timeout=self.http_timeout)
+        return self.http_session
+
+    def get_cache_state(self):
+        today = self.get_now().date().isoformat()
+        entry = self.image_cache.get(today)
+        cached_path = os.path.join(self.cache_dir, entry['file']) if entry else None
+        if cached_path and not os.path.exists(cached_path):
+            entry = cached_path = None
+        return today, entry, cached_path
+
+    def is_cache_fresh(self, entry):
+        return bool(entry) and self.clock() - entry.get('checked_at', 0) < self.cache_revalidate_seconds
+
+    async def fetch_zxs_image(self, today, entry, cached_path):
+        try:
+            session = self.get_http_session()
+            image_url = await self.get_zxs_image_url(session)
+            if not image_url:
+                return None, False
+            headers = {}
+            if entry and entry.get('url') == image_url:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            download_start = time.perf_counter()
+            result = 'error'
+            try:
+                async with session.get(image_url, headers=headers) as res:
+                    if res.status == 304 and entry:
+                        result = 'not_modified'
+                        entry['checked_at'] = self.clock()
+                        self.save_image_cache()
+                        return cached_path, True
+                    if res.status == 200:
+                        url_hash = hashlib.sha1(image_url.encode('utf-8')).hexdigest()[:12]
+                        file_name = f"zxs60s_{today}_{url_hash}.jpg"
+                        image_path = os.path.join(self.cache_dir, file_name)
+                        image_size = await self.download_image(res, image_path)
+                        previous = self.image_cache.get(today)
+                        self.image_cache[today] = {
+                            'url': image_url,
+                            'file': file_name,
+                            'etag': res.headers.get('ETag'),
+                            'last_modified': res.headers.get('Last-Modified'),
+                            'size': image_size,
+                            'checked_at': self.clock()
+                        }
+                        if previous and previous.get('file') != file_name:
+                            # 当天图片链接变化时替换旧文件，避免脱离索引的文件绕过缓存上限
+                            self.remove_cache_files(os.path.splitext(previous['file'])[0])
+                        self.evict_image_cache(today)
+                        self.save_image_cache()
+                        result = 'ok'
+                        self.metrics.inc('image_download_bytes_total', value=image_size)
+                        for rule in set(self.image_variant_rules.values()):
+                            self.get_image_variant_task(image_path, rule)
+                        return image_path, True
+                    logger.error(f"下载今日简报图片失败，HTTP 状态码: {res.status}")
+            except Exception as e:
+                logger.error(f"下载今日简报图片失败: {e}")
+                return image_url, False
+            finally:
+                self.metrics.inc('image_downloads_total', {'result': result})
+                self.metrics.observe('image_download_seconds', time.perf_counter() - download_start)
+            return None, False
         except Exception as e:
             logger.error(f"获取今日简报图片时出错: {e.__class__.__name__}: {str(e)}")
+            return None, False
+
+    async def refresh_zxs_image(self, today, entry, cached_path):
+        # 同一天的并发刷新共用一次上游请求与下载，调用方被取消时不影响其他等待者
+        task = self.refresh_inflight.get(today)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self.run_refresh(today, entry, cached_path))
+            self.refresh_inflight[today] = task
+        else:
+            self.metrics.inc('image_fetch_coalesced_total')
+        return await asyncio.shield(task)
+
+    async def run_refresh(self, today, entry, cached_path):
+        try:
+            return await self.fetch_with_breaker(today, entry, cached_path)
+        finally:
+            self.refresh_inflight.pop(today, None)
+
+    async def fetch_with_breaker(self, today, entry, cached_path):
+        if not self.upstream_breaker.allow():
+            self.metrics.inc('breaker_rejections_total')
+            return None, False
+        try:
+            image_path, ok = await asyncio.wait_for(
+                self.fetch_zxs_image(today, entry, cached_path), timeout=self.fetch_deadline
+            )
+        except asyncio.TimeoutError:
+            logger.error(f"获取今日简报超时（超过 {self.fetch_deadline:g} 秒）")
+            image_path, ok = None, False
+        if ok:
+            self.upstream_breaker.record_success()
+        elif self.upstream_breaker.record_failure():
+            self.metrics.inc('breaker_opened_total')
+            logger.error(f"简报接口连续失败，熔断 {self.upstream_breaker.reset_timeout:g} 秒，期间使用缓存图片并在后台重试")
+        return image_path, ok
+
+    def get_stale_image(self, today):
+        if self.stale_mode == 'off':
+            return None, None
+        oldest_day = (datetime.date.fromisoformat(today) - datetime.timedelta(days=self.stale_max_days)).isoformat()
+        for day in sorted(self.image_cache, reverse=True):
+            if oldest_day <= day < today:
+                image_path = os.path.join(self.cache_dir, self.image_cache[day]['file'])
+                if os.path.exists(image_path):
+                    self.metrics.inc('stale_served_total')
+                    logger.info(f"今日简报暂不可用，使用 {day} 的缓存简报")
+                    return image_path, day
+        return None, None
+
+    def start_background_refresh(self):
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.get_running_loop().create_task(self.background_refresh())
+
+    async def background_refresh(self):
+        while not self.stopping:
+            await asyncio.sleep(max(self.upstream_breaker.get_retry_delay(), 5))
+            try:
+                today, entry, cached_path = self.get_cache_state()
+                if self.is_cache_fresh(entry):
+                    return
+                image_path, ok = await self.refresh_zxs_image(today, entry, cached_path)
+                if ok:
+                    logger.info("后台刷新今日简报成功")
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"后台刷新今日简报出错: {e}")
+
+    async def get_zxs_image_info(self):
+        today, entry, cached_path = self.get_cache_state()
+        if self.is_cache_fresh(entry):
+            self.metrics.inc('image_cache_hits_total')
+            return cached_path, None
+        self.metrics.inc('image_cache_misses_total')
+        image_path, ok = await self.refresh_zxs_image(today, entry, cached_path)
+        if ok:
+            return image_path, None
+        # 上游不可用时不阻塞发送：优先当天已缓存的图片，其次是图片链接，最后才是往日的缓存
+        self.start_background_refresh()
+        if cached_path:
+            return cached_path, None
+        if image_path:
+            return image_path, None
+        return self.get_stale_image(today)
+
+    async def get_zxs_image(self):
+        image_path, stale_day = await self.get_zxs_image_info()
+        return image_path
+
+    def get_stale_notice(self, stale_day):
+        if not stale_day or self.stale_mode != 'notice':
             return None
+        return self.stale_notice.replace('{day}', stale_day)
 
     def parse_time(self, time: str):
         try:
@@ -143,6 +1063,141 @@ class MyPlugin(Star):
             except ValueError:
                 return None
 
+    def parse_variant_rules(self, items):
+        rules = {}
+        for item in items or []:
+            try:
+                platform, spec = str(item).split('=', 1)
+                parts = [part.strip() for part in spec.split(',')]
+                image_format = parts[0].lower()
+                if image_format == 'jpg':
+                    image_format = 'jpeg'
+                if image_format not in ('jpeg', 'webp'):
+                    raise ValueError(image_format)
+                max_kb = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+                max_width = int(parts[2]) if len(parts) > 2 and parts[2] else 0
+                max_height = int(parts[3]) if len(parts) > 3 and parts[3] else 0
+                rules[platform.strip()] = (image_format, max_kb, max_width, max_height)
+            except (ValueError, IndexError):
+                logger.error(f"图片优化配置格式错误，应为 平台名=格式,最大KB,最大宽,最大高: {item}")
+        if rules and PILImage is None:
+            logger.error("未安装 Pillow，图片优化已停用，将发送原图")
+            return {}
+        return rules
+
+    def build_image_variant(self, source_path, variant_path, rule):
+        image_format, max_kb, max_width, max_height = rule
+        max_bytes = max_kb * 1024
+        with PILImage.open(source_path) as source:
+            image = source.convert('RGB')
+        if max_width or max_height:
+            image.thumbnail((max_width or image.width, max_height or image.height), PILImage.LANCZOS)
+        data = None
+        # 先逐步降低质量，仍超出预算再按比例缩小尺寸
+        for _ in range(8):
+            for quality in (85, 75, 65, 55, 45):
+                buffer = io.BytesIO()
+                image.save(buffer, format=image_format.upper(), quality=quality, optimize=True)
+                data = buffer.getvalue()
+                if not max_bytes or len(data) <= max_bytes:
+                    break
+            if not max_bytes or len(data) <= max_bytes:
+                break
+            image = image.resize((max(int(image.width * 0.85), 1), max(int(image.height * 0.85), 1)), PILImage.LANCZOS)
+        if len(data) >= os.path.getsize(source_path) and not (max_width or max_height):
+            return None
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, variant_path)
+        return variant_path
+
+    def get_variant_path(self, image_path, rule):
+        image_format, max_kb, max_width, max_height = rule
+        stem = os.path.splitext(image_path)[0]
+        extension = 'jpg' if image_format == 'jpeg' else image_format
+        return f"{stem}__{image_format}_{max_kb}k_{max_width}x{max_height}.{extension}"
+
+    def get_image_variant_task(self, image_path, rule):
+        variant_path = self.get_variant_path(image_path, rule)
+        task = self.variant_tasks.get(variant_path)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = loop.run_in_executor(self.image_executor, self.build_image_variant, image_path, variant_path, rule)
+            task.add_done_callback(self.log_variant_error)
+            self.variant_tasks[variant_path] = task
+        return task
+
+    def log_variant_error(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"生成优化图片失败: {task.exception()}")
+
+    async def get_image_variant(self, image_path, platform):
+        rule = self.image_variant_rules.get(platform) or self.image_variant_rules.get('*')
+        if not rule or not os.path.exists(image_path):
+            return image_path
+        variant_path = self.get_variant_path(image_path, rule)
+        if variant_path not in self.variant_tasks and os.path.exists(variant_path):
+            return variant_path
+        start = time.perf_counter()
+        try:
+            result = await self.get_image_variant_task(image_path, rule)
+        except Exception:
+            self.variant_tasks.pop(variant_path, None)
+            return image_path
+        self.metrics.observe('image_optimize_seconds', time.perf_counter() - start)
+        return result or image_path
+
+    def get_media_mode(self, platform):
+        if platform in self.media_url_platforms:
+            return 'url'
+        if platform in self.media_base64_platforms:
+            return 'base64'
+        return 'file'
+
+    def get_cached_image_url(self, image_path):
+        file_name = os.path.basename(image_path)
+        for entry in self.image_cache.values():
+            if entry.get('file') == file_name:
+                return entry.get('url')
+        return None
+
+    def read_image_base64(self, image_path):
+        with open(image_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode()
+
+    async def get_media_chain(self, image_path, platform):
+        if not os.path.exists(image_path):
+            return MessageChain([Image.fromURL(image_path)])
+        mode = self.get_media_mode(platform)
+        image_url = self.get_cached_image_url(image_path) if mode == 'url' else None
+        if mode == 'url' and not image_url:
+            mode = 'file'
+        media_path = await self.get_image_variant(image_path, platform) if mode != 'url' else image_path
+        # 以文件的修改时间区分同名文件的新旧内容，同一份图片每种发送方式只准备一次
+        key = (image_path, os.stat(image_path).st_mtime_ns, mode, media_path)
+        message_chain = self.media_cache.get(key)
+        if message_chain is not None:
+            return message_chain
+        async with self.media_lock:
+            message_chain = self.media_cache.get(key)
+            if message_chain is not None:
+                return message_chain
+            if mode == 'base64':
+                # 需要 base64 的适配器会直接使用已编码的数据，不再逐群读取和编码文件
+                component = Image.fromBase64(await asyncio.to_thread(self.read_image_base64, media_path))
+            elif mode == 'url':
+                component = Image.fromURL(image_url)
+            else:
+                component = Image.fromFileSystem(media_path)
+            message_chain = MessageChain([component])
+            self.media_cache = {k: v for k, v in self.media_cache.items() if k[:2] == key[:2]}
+            self.media_cache[key] = message_chain
+            self.metrics.inc('media_prepared_total', {'mode': mode})
+            return message_chain
+
     @filter.command("zxs_time")
     async def set_time(self, event: AstrMessageEvent, time: str):
         time = time.strip()
@@ -159,8 +1214,9 @@ class MyPlugin(Star):
         self.group_schedules[group_id]['time'] = parsed_time
         self.group_schedules[group_id]['target'] = event.unified_msg_origin
         self.group_schedules[group_id]['origin'] = origin_str
+        self.reschedule_group(group_id)
         yield event.plain_result(f"本群组今日简报发送时间已设置为: {parsed_time}")
-        self.save_schedule()
+        await self.persist_group(group_id)
 
     def save_config(self):
         try:
@@ -177,7 +1233,40 @@ class MyPlugin(Star):
             logger.error(f"保存配置文件时出错: {e}")
 
     async def terminate(self):
-        pass
+        self.stopping = True
+        for task in list(self.background_tasks):
+            task.cancel()
+        if self.background_tasks:
+            done, pending = await asyncio.wait(set(self.background_tasks), timeout=5)
+            if pending:
+                logger.error(f"{len(pending)} 个后台任务未能在 5 秒内停止")
+        # 正在发送的批次给一段时间收尾，超时未完成的交给下次启动的补发与重试队列
+        if self.dispatch_tasks:
+            logger.info(f"等待 {len(self.dispatch_tasks)} 个发送批次完成")
+            done, pending = await asyncio.wait(set(self.dispatch_tasks), timeout=self.shutdown_drain_seconds)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.error(f"{len(pending)} 个发送批次在 {self.shutdown_drain_seconds:g} 秒内未完成，已取消")
+                await asyncio.gather(*pending, return_exceptions=True)
+        # 图片刷新在发送批次收尾之后再取消，否则等待图片的批次会被连带取消
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+        for task in list(self.refresh_inflight.values()):
+            task.cancel()
+        if self.schedule_store.conn is not None:
+            try:
+                if self.cluster_mode:
+                    # 主动注销，其他节点下一次心跳即可接管本节点的分片
+                    await self.schedule_store.submit(self.schedule_store.remove_node, self.node_id)
+                await self.schedule_store.submit(self.schedule_store.close)
+            except Exception as e:
+                logger.error(f"关闭定时任务存储失败: {e}")
+        self.schedule_store.executor.shutdown(wait=False)
+        self.image_executor.shutdown(wait=False)
+        if self.http_session is not None and not self.http_session.closed:
+            await self.http_session.close()
+        self.http_session = None
 
     @filter.command("gg_tasks")
     async def toggle(self, event: AstrMessageEvent):
@@ -185,54 +1274,78 @@ class MyPlugin(Star):
         status = "启用" if self.enabled else "禁用"
         self.config["enabled"] = self.enabled
         self.save_config()
-        self.save_schedule()
         yield event.plain_result(f"今日简报定时任务已{status}")
-        self.load_schedule()
+        await self.load_schedule()
 
     @filter.command("cl_time")
     async def reset_time(self, event: AstrMessageEvent):
         group_id = self.get_group_id(event.unified_msg_origin)
         if group_id in self.group_schedules:
             del self.group_schedules[group_id]
-            self.save_schedule()
+            self.reschedule_group(group_id)
+            await self.persist_group(group_id)
             yield event.plain_result("本群组定时发送已取消")
         else:
             yield event.plain_result("本群组未设置发送时间")
 
+    def get_test_wait(self, origin):
+        now = self.clock()
+        waits = []
+        last_run = self.test_last_run.get(origin)
+        if last_run is not None:
+            waits.append(last_run + self.test_cooldown - now)
+        if self.test_global_last_run is not None:
+            waits.append(self.test_global_last_run + self.test_global_cooldown - now)
+        wait = max(waits, default=0)
+        if wait > 0:
+            return wait
+        self.test_global_last_run = now
+        self.test_last_run[origin] = now
+        if len(self.test_last_run) > 1024:
+            self.test_last_run = {key: ts for key, ts in self.test_last_run.items() if ts + self.test_cooldown > now}
+        return 0
+
+    def release_test_cooldown(self, origin, started_at):
+        # 未取得图片时撤销本次记录，用户可以立即重试；期间已被新的调用覆盖的记录保持不变
+        if self.test_last_run.get(origin) == started_at:
+            del self.test_last_run[origin]
+        if self.test_global_last_run == started_at:
+            self.test_global_last_run = None
+
     @filter.command("zxs_test")
     async def execute_now(self, event: AstrMessageEvent):
-        image_path = await self.get_zxs_image()
+        origin = self.get_origin_str(event.unified_msg_origin)
+        wait = self.get_test_wait(origin)
+        if wait:
+            self.metrics.inc('test_throttled_total')
+            yield event.plain_result(f"操作过于频繁，请 {math.ceil(wait)} 秒后再试")
+            return
+        # 冷却在获取图片前记录，防止并发刷屏同时穿过检查
+        started_at = self.test_last_run.get(origin)
+        image_path, stale_day = await self.get_zxs_image_info()
         if not image_path:
+            self.release_test_cooldown(origin, started_at)
             yield event.plain_result("获取今日简报失败，请稍后再试")
             return
         
-        if os.path.exists(image_path):
-            chain = [
-                Image.fromFileSystem(image_path)
-            ]
-        else:
-            chain = [
-                Image.fromURL(image_path)
-            ]
+        message_chain = await self.get_media_chain(image_path, self.get_platform_name(event.unified_msg_origin))
+        chain = list(message_chain.chain)
+        stale_notice = self.get_stale_notice(stale_day)
+        if stale_notice:
+            chain = [Plain(stale_notice)] + chain
         
-        max_retries = 3
-        for retry in range(max_retries):
-            try:
-                yield event.chain_result(chain)
-                logger.info("今日简报发送成功")
-                break
-            except Exception as e:
-                if retry < max_retries - 1:
-                    logger.error(f"发送消息失败，第 {retry + 1} 次重试: {str(e)}")
-                    await asyncio.sleep(5)
-                else:
-                    logger.error(f"发送消息失败，达到最大重试次数: {str(e)}")
-                    yield event.plain_result("发送消息失败，请稍后再试")
+        group_id = self.get_group_id(event.unified_msg_origin)
+        sent, error = await self.send_once(group_id, event.unified_msg_origin, MessageChain(chain))
+        if sent:
+            logger.info("今日简报发送成功")
+            return
+        await self.enqueue_retry(group_id, event.unified_msg_origin, self.get_now().date().isoformat(), 'manual', None, 1, error)
+        yield event.plain_result("发送消息失败，已加入重试队列，稍后会自动重发")
 
     def get_next_send_time(self, time_str):
         if not time_str:
             return None
-        now = datetime.datetime.now(self.user_custom_timezone)
+        now = self.get_now()
         try:
             target_hour, target_minute = map(int, time_str.split(':'))
             target_time = now.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)
@@ -242,239 +1355,961 @@ class MyPlugin(Star):
         except:
             return None
 
+    def parse_task_id(self, value):
+        try:
+            return int(value.strip().lstrip('#'))
+        except ValueError:
+            return None
+
     @filter.command("zxs_doc")
-    async def list_tasks(self, event: AstrMessageEvent):
-        active_tasks = []
-        inactive_tasks = []
+    async def list_tasks(self, event: AstrMessageEvent, page: str = "1"):
+        try:
+            page_num = int(str(page).strip())
+        except ValueError:
+            yield event.plain_result("页码格式错误，请输入数字")
+            return
         
-        for group_id, schedule_info in self.group_schedules.items():
-            time_str = schedule_info.get('time')
-            target = schedule_info.get('target')
-            
-            if time_str:
-                next_send_time = self.get_next_send_time(time_str)
-                task_info = {
-                    'group_id': group_id,
-                    'time': time_str,
-                    'next_send': next_send_time
-                }
-                
-                if target:
-                    active_tasks.append(task_info)
-                else:
-                    inactive_tasks.append(task_info)
+        active_count = len(self.task_registry.active_order)
+        inactive_count = len(self.task_registry.inactive_order)
+        total = active_count + inactive_count
+        if total == 0:
+            yield event.plain_result("当前没有定时任务")
+            return
+        
+        page_count = (total + self.doc_page_size - 1) // self.doc_page_size
+        if page_num < 1 or page_num > page_count:
+            yield event.plain_result(f"页码 {page_num} 无效，当前共 {page_count} 页")
+            return
+        
+        offset = (page_num - 1) * self.doc_page_size
+        active_ids = self.task_registry.list_active(self.get_now(), offset, self.doc_page_size)
+        inactive_offset = max(offset - active_count, 0)
+        inactive_ids = self.task_registry.list_inactive(inactive_offset, self.doc_page_size - len(active_ids))
         
         result_lines = []
         
-        if active_tasks:
-            result_lines.append(f"当前共有{len(active_tasks)}个正在运行的定时任务:")
-            for idx, task in enumerate(active_tasks, 1):
-                next_send_str = task['next_send'].strftime("%Y-%m-%d %H:%M:%S") if task['next_send'] else "未知"
-                result_lines.append(f"{idx}. 群组:{task['group_id']}")
-                result_lines.append(f"   时间: {task['time']}")
+        if active_ids:
+            result_lines.append(f"当前共有{active_count}个正在运行的定时任务（按下次发送时间排序）:")
+            for task_id in active_ids:
+                group_id = self.task_registry.get_group_id(task_id)
+                time_str = self.group_schedules[group_id].get('time')
+                next_send = self.get_next_send_time(time_str)
+                next_send_str = next_send.strftime("%Y-%m-%d %H:%M:%S") if next_send else "未知"
+                result_lines.append(f"#{task_id} 群组:{group_id}")
+                result_lines.append(f"   时间: {time_str}")
                 result_lines.append(f"   下次发送:{next_send_str}")
         
-        if inactive_tasks:
+        if inactive_ids:
             if result_lines:
                 result_lines.append("")
-            result_lines.append(f"⚠️ 发现 {len(inactive_tasks)} 个无效的定时任务 (已保存但未激活,不会发送):")
-            for idx, task in enumerate(inactive_tasks, len(active_tasks) + 1):
-                result_lines.append(f"{idx}. {task['group_id']} - {task['time']}")
+            result_lines.append(f"⚠️ 发现 {inactive_count} 个无效的定时任务 (已保存但未激活,不会发送):")
+            for task_id in inactive_ids:
+                group_id = self.task_registry.get_group_id(task_id)
+                time_str = self.group_schedules[group_id].get('time') or "未设置"
+                result_lines.append(f"#{task_id} {group_id} - {time_str}")
             result_lines.append("💡 可以在对应群组使用 /cl_time 清除这些无效任务")
-            result_lines.append("💡 或使用 /zxs_up <序号> 激活这些任务")
+            result_lines.append("💡 或使用 /zxs_up <任务ID> 激活这些任务")
         
-        if not active_tasks and not inactive_tasks:
-            result_lines.append("当前没有定时任务")
+        warm_state_text = self.get_warm_state_text()
+        if active_count and warm_state_text and page_num == 1:
+            result_lines.append("")
+            result_lines.append(warm_state_text)
+        
+        if page_count > 1:
+            result_lines.append("")
+            result_lines.append(f"第 {page_num}/{page_count} 页，使用 /zxs_doc <页码> 查看其他页")
         
         yield event.plain_result("\n".join(result_lines))
 
     @filter.command("zxs_doc_del")
     async def delete_task(self, event: AstrMessageEvent, index: str):
-        try:
-            task_index = int(index.strip())
-        except ValueError:
-            yield event.plain_result("序号格式错误，请输入数字")
+        task_id = self.parse_task_id(index)
+        if task_id is None:
+            yield event.plain_result("任务ID格式错误，请输入数字")
             return
         
-        active_tasks = []
-        inactive_tasks = []
+        group_id_to_delete = self.task_registry.get_group_id(task_id)
+        if group_id_to_delete is None or group_id_to_delete not in self.group_schedules:
+            yield event.plain_result(f"任务ID {task_id} 不存在，请使用 /zxs_doc 查看当前任务")
+            return
         
-        for group_id, schedule_info in self.group_schedules.items():
-            time_str = schedule_info.get('time')
-            target = schedule_info.get('target')
-            
-            if time_str:
-                next_send_time = self.get_next_send_time(time_str)
-                task_info = {
-                    'group_id': group_id,
-                    'time': time_str,
-                    'next_send': next_send_time
-                }
-                
-                if target:
-                    active_tasks.append(task_info)
-                else:
-                    inactive_tasks.append(task_info)
+        del self.group_schedules[group_id_to_delete]
+        self.reschedule_group(group_id_to_delete)
+        await self.persist_group(group_id_to_delete)
+        yield event.plain_result(f"已删除任务ID {task_id} 的定时任务: {group_id_to_delete}")
+
+    @filter.command("zxs_up")
+    async def activate_task(self, event: AstrMessageEvent, index: str):
+        task_id = self.parse_task_id(index)
+        if task_id is None:
+            yield event.plain_result("任务ID格式错误，请输入数字")
+            return
         
-        all_tasks = active_tasks + inactive_tasks
+        if not self.task_registry.inactive_order:
+            yield event.plain_result("当前没有未激活的定时任务")
+            return
         
-        if task_index < 1 or task_index > len(all_tasks):
-            yield event.plain_result(f"序号 {task_index} 无效，当前共有 {len(all_tasks)} 个任务")
+        group_id_to_activate = self.task_registry.get_group_id(task_id)
+        if group_id_to_activate is None or group_id_to_activate not in self.group_schedules:
+            yield event.plain_result(f"任务ID {task_id} 不存在，请使用 /zxs_doc 查看未激活任务的ID")
+            return
+        if self.task_registry.is_active(task_id):
+            yield event.plain_result(f"任务ID {task_id} 已在运行中，无需激活")
             return
         
-        task_to_delete = all_tasks[task_index - 1]
-        group_id_to_delete = task_to_delete['group_id']
+        current_group_id = self.get_group_id(event.unified_msg_origin)
+        time_str = self.group_schedules[group_id_to_activate]['time']
+        origin_str = self.get_origin_str(event.unified_msg_origin)
+        if group_id_to_activate != current_group_id:
+            # 任务迁移到当前群组时保留原任务ID
+            self.task_registry.remove(group_id_to_activate)
+            self.task_registry.remove(current_group_id)
+            self.task_registry.update(current_group_id, time_str, True, task_id)
+            self.group_schedules[current_group_id] = {
+                'time': time_str,
+                'target': event.unified_msg_origin,
+                'origin': origin_str
+            }
+            del self.group_schedules[group_id_to_activate]
+            self.reschedule_group(group_id_to_activate)
+        else:
+            self.group_schedules[group_id_to_activate]['target'] = event.unified_msg_origin
+            self.group_schedules[group_id_to_activate]['origin'] = origin_str
+        self.reschedule_group(current_group_id)
         
-        if group_id_to_delete in self.group_schedules:
-            del self.group_schedules[group_id_to_delete]
-            self.save_schedule()
-            yield event.plain_result(f"已删除序号 {task_index} 的定时任务: {group_id_to_delete}")
+        await self.persist_group(group_id_to_activate)
+        if group_id_to_activate != current_group_id:
+            await self.persist_group(current_group_id)
+        yield event.plain_result(f"已激活任务ID {task_id} 的定时任务: {time_str}")
+
+
+    def get_command_text(self, event: AstrMessageEvent):
+        # 批量命令的参数可能包含空格与换行，直接从原始消息中截取命令名之后的内容
+        parts = re.split(r'\s+', event.message_str.strip(), maxsplit=1)
+        return parts[1].strip() if len(parts) > 1 else ""
+
+    def export_schedule_rows(self):
+        rows = []
+        for group_id in self.group_schedules:
+            group_id, time_str, origin, task_id = self.get_schedule_row(group_id, self.group_schedules[group_id])
+            rows.append({'task_id': task_id, 'group_id': group_id, 'origin': origin or "", 'time': time_str or ""})
+        rows.sort(key=lambda row: row['task_id'] or 0)
+        return rows
+
+    def write_export_file(self, rows, file_format):
+        os.makedirs(self.export_dir, exist_ok=True)
+        file_name = f"schedule_{self.get_now().strftime('%Y%m%d_%H%M%S')}.{file_format}"
+        file_path = os.path.join(self.export_dir, file_name)
+        fd, temp_path = tempfile.mkstemp(dir=self.export_dir, suffix='.part')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            if file_format == 'csv':
+                writer = csv.DictWriter(f, fieldnames=['task_id', 'group_id', 'origin', 'time'])
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                json.dump({'version': 1, 'schedules': rows}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, file_path)
+        return file_path
+
+    def parse_import_content(self, content):
+        content = content.lstrip('\ufeff').strip()
+        if content.startswith('{') or content.startswith('['):
+            data = json.loads(content)
+            if isinstance(data, dict):
+                # 兼容导出格式与旧版 schedule.json 的 group_schedules 结构
+                if 'schedules' in data:
+                    data = data['schedules']
+                elif 'group_schedules' in data:
+                    data = [dict(info, group_id=group_id) for group_id, info in data['group_schedules'].items()]
+            if not isinstance(data, list):
+                raise ValueError("JSON 内容应为任务列表")
+            records = data
         else:
-            yield event.plain_result(f"删除失败，任务不存在")
+            records = list(csv.DictReader(io.StringIO(content)))
+        entries = []
+        for row_number, record in enumerate(records, 1):
+            if not isinstance(record, dict):
+                raise ValueError(f"第 {row_number} 条任务格式错误")
+            origin = str(record.get('origin') or "").strip()
+            group_id = str(record.get('group_id') or origin).strip()
+            time_str = self.parse_time(str(record.get('time') or "").strip())
+            if not group_id or not time_str:
+                raise ValueError(f"第 {row_number} 条任务缺少群组或时间格式错误")
+            task_id = self.parse_task_id(str(record.get('task_id') or ""))
+            entries.append((group_id, origin or None, time_str, task_id))
+        return entries
 
-    @filter.command("zxs_up")
-    async def activate_task(self, event: AstrMessageEvent, index: str):
+    def read_import_source(self, text):
+        if text.startswith('{') or text.startswith('[') or '\n' in text:
+            return text
+        # 只允许读取 export 目录中的文件，避免通过命令读取主机上的任意文件
+        if os.sep in text or (os.altsep and os.altsep in text) or text in ('.', '..'):
+            raise ValueError("只能导入 export 目录中的文件，请只填写文件名")
+        file_path = os.path.join(self.export_dir, text)
+        if not os.path.isfile(file_path):
+            raise ValueError(f"export 目录中不存在文件 {text}")
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def parse_group_filter(self, text):
+        text = text.strip()
+        if text in ('all', '全部'):
+            return lambda group_id, task_id, info: True
+        match = re.fullmatch(r'#?(\d+)-#?(\d+)', text)
+        if match:
+            low, high = sorted((int(match.group(1)), int(match.group(2))))
+            return lambda group_id, task_id, info: task_id is not None and low <= task_id <= high
+        if ':' in text:
+            time_str = self.parse_time(text)
+            if time_str is None:
+                return None
+            return lambda group_id, task_id, info: info.get('time') == time_str
+        task_id = self.parse_task_id(text)
+        if task_id is not None:
+            return lambda group_id, task_id_, info: task_id_ == task_id
+        return lambda group_id, task_id, info: self.get_platform_name(group_id) == text
+
+    def select_groups(self, group_filter):
+        return [group_id for group_id, info in self.group_schedules.items()
+                if group_filter(group_id, self.task_registry.get_task_id(group_id), info)]
+
+    async def sync_schedule(self):
+        # 协同模式下批量修改前先同步其他节点的改动，避免基于过期数据修改
+        if not self.cluster_mode:
+            return
+        revision = await self.schedule_store.submit(self.schedule_store.get_meta, 'schedule_revision', 0)
+        if revision != self.schedule_revision:
+            await self.load_schedule()
+            self.schedule_revision = revision
+
+    def note_own_revision(self, revision):
+        # 本节点的写入紧接在已知修订之后时直接记下，心跳不会因自己的写入重新加载；
+        # 期间有其他节点写入时修订号不连续，仍由心跳重新加载
+        if self.schedule_revision is not None and revision == self.schedule_revision + 1:
+            self.schedule_revision = revision
+
+    async def apply_bulk_changes(self, group_ids):
+        # 批量修改的群组在一个事务中写入，并一次性重建调度堆
+        self.rebuild_schedule_heap()
+        await self.save_groups(group_ids)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_export")
+    async def export_schedule(self, event: AstrMessageEvent, file_format: str = "json"):
+        file_format = file_format.strip().lower()
+        if file_format not in ('json', 'csv'):
+            yield event.plain_result("导出格式错误，请使用 json 或 csv")
+            return
+        rows = self.export_schedule_rows()
         try:
-            task_index = int(index.strip())
+            file_path = await asyncio.get_running_loop().run_in_executor(None, self.write_export_file, rows, file_format)
+        except Exception as e:
+            logger.error(f"导出定时任务失败: {e}")
+            yield event.plain_result("导出定时任务失败，请查看日志")
+            return
+        yield event.plain_result(f"已导出 {len(rows)} 个定时任务到:\n{file_path}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_import")
+    async def import_schedule(self, event: AstrMessageEvent):
+        text = self.get_command_text(event)
+        if not text:
+            yield event.plain_result("请提供导出文件名/路径，或直接附上 JSON/CSV 内容")
+            return
+        try:
+            content = await asyncio.get_running_loop().run_in_executor(None, self.read_import_source, text)
+            entries = self.parse_import_content(content)
+        except Exception as e:
+            logger.error(f"解析导入内容失败: {e}")
+            yield event.plain_result(f"导入失败: {e}")
+            return
+        await self.sync_schedule()
+        created = updated = 0
+        for group_id, origin, time_str, task_id in entries:
+            schedule_info = self.group_schedules.get(group_id)
+            if schedule_info is None:
+                created += 1
+                schedule_info = self.group_schedules[group_id] = {}
+                # 新群组尽量沿用文件中的任务ID，冲突时重新分配
+                self.task_registry.update(group_id, time_str, bool(origin), task_id)
+            else:
+                updated += 1
+            schedule_info['time'] = time_str
+            if origin:
+                schedule_info['target'] = origin
+                schedule_info['origin'] = origin
+            else:
+                schedule_info.setdefault('target', None)
+                schedule_info.setdefault('origin', None)
+        await self.apply_bulk_changes([entry[0] for entry in entries])
+        yield event.plain_result(f"导入完成：新增 {created} 个，更新 {updated} 个定时任务")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_bulk_time")
+    async def bulk_set_time(self, event: AstrMessageEvent, selector: str, time: str):
+        group_filter = self.parse_group_filter(selector)
+        parsed_time = self.parse_time(time.strip())
+        if group_filter is None or not parsed_time:
+            yield event.plain_result("参数格式错误，例如：/zxs_bulk_time aiocqhttp 08:00")
+            return
+        await self.sync_schedule()
+        group_ids = self.select_groups(group_filter)
+        if not group_ids:
+            yield event.plain_result("没有符合条件的定时任务")
+            return
+        for group_id in group_ids:
+            self.group_schedules[group_id]['time'] = parsed_time
+        await self.apply_bulk_changes(group_ids)
+        yield event.plain_result(f"已将 {len(group_ids)} 个定时任务的发送时间设置为: {parsed_time}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_bulk_shift")
+    async def bulk_shift_time(self, event: AstrMessageEvent, selector: str, minutes: str):
+        group_filter = self.parse_group_filter(selector)
+        try:
+            delta = int(minutes.strip())
         except ValueError:
-            yield event.plain_result("序号格式错误，请输入数字")
+            delta = None
+        if group_filter is None or delta is None:
+            yield event.plain_result("参数格式错误，例如：/zxs_bulk_shift 08:00 +15")
             return
-        
-        active_tasks = []
-        inactive_tasks = []
-        inactive_group_ids = []
-        
-        for group_id, schedule_info in self.group_schedules.items():
+        await self.sync_schedule()
+        shifted = []
+        for group_id in self.select_groups(group_filter):
+            minute = self.task_registry.get_minute(self.group_schedules[group_id].get('time'))
+            if minute is None:
+                continue
+            minute = (minute + delta) % (24 * 60)
+            self.group_schedules[group_id]['time'] = f"{minute // 60:02d}:{minute % 60:02d}"
+            shifted.append(group_id)
+        if not shifted:
+            yield event.plain_result("没有符合条件的定时任务")
+            return
+        await self.apply_bulk_changes(shifted)
+        yield event.plain_result(f"已将 {len(shifted)} 个定时任务的发送时间平移 {delta:+d} 分钟")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_up_all")
+    async def activate_all(self, event: AstrMessageEvent):
+        await self.sync_schedule()
+        activated = []
+        skipped = 0
+        for task_id in list(self.task_registry.inactive_order):
+            group_id = self.task_registry.get_group_id(task_id)
+            schedule_info = self.group_schedules.get(group_id)
+            if schedule_info is None:
+                continue
+            # 旧版数据的群组ID即会话标识（平台:类型:ID），可直接作为发送目标
+            parts = group_id.split(':', 2)
+            if len(parts) != 3 or not all(parts) or not schedule_info.get('time'):
+                skipped += 1
+                continue
+            schedule_info['target'] = group_id
+            schedule_info['origin'] = group_id
+            activated.append(group_id)
+        if not activated:
+            yield event.plain_result(f"没有可批量激活的任务（{skipped} 个无法识别会话，请在对应群组使用 /zxs_up）")
+            return
+        await self.apply_bulk_changes(activated)
+        result = f"已激活 {len(activated)} 个未激活的定时任务"
+        if skipped:
+            result += f"，{skipped} 个无法识别会话，请在对应群组使用 /zxs_up"
+        yield event.plain_result(result)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_dlq")
+    async def list_dead_letters(self, event: AstrMessageEvent, page: str = "1"):
+        try:
+            page_num = max(int(str(page).strip()), 1)
+        except ValueError:
+            yield event.plain_result("页码格式错误，请输入数字")
+            return
+        offset = (page_num - 1) * self.doc_page_size
+        total, rows = await self.schedule_store.submit(self.schedule_store.list_dead_letters, offset, self.doc_page_size)
+        pending = await self.schedule_store.submit(self.schedule_store.count_retries)
+        result_lines = [f"重试队列中有 {pending} 条待重试的发送"]
+        if not total:
+            result_lines.append("死信列表为空")
+            yield event.plain_result("\n".join(result_lines))
+            return
+        result_lines.append(f"死信列表共 {total} 条（多次重试仍失败、已放弃发送）:")
+        for dead_id, group_id, day, kind, time_str, attempts, last_error, failed_at in rows:
+            kind_str = "定时" if kind == 'scheduled' else "手动"
+            failed_str = datetime.datetime.fromtimestamp(failed_at, self.user_custom_timezone).strftime("%m-%d %H:%M")
+            result_lines.append(f"{dead_id}. {group_id}")
+            result_lines.append(f"   {day} {time_str or ''} {kind_str}发送，尝试 {attempts} 次，{failed_str} 放弃")
+            result_lines.append(f"   原因: {last_error or '未知'}")
+        page_count = (total + self.doc_page_size - 1) // self.doc_page_size
+        if page_count > 1:
+            result_lines.append(f"第 {min(page_num, page_count)}/{page_count} 页，使用 /zxs_dlq <页码> 查看其他页")
+        result_lines.append("💡 使用 /zxs_dlq_clear 清空死信列表")
+        yield event.plain_result("\n".join(result_lines))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("zxs_dlq_clear")
+    async def clear_dead_letters(self, event: AstrMessageEvent):
+        removed = await self.schedule_store.submit(self.schedule_store.clear_dead_letters)
+        yield event.plain_result(f"已清空死信列表，共 {removed} 条")
+
+    def format_seconds(self, value):
+        return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+    @filter.command("zxs_stats")
+    async def show_stats(self, event: AstrMessageEvent):
+        metrics = self.metrics
+        uptime = int(time.time() - metrics.started_at)
+        result_lines = [f"📊 今日简报运行统计（已运行 {uptime // 3600} 小时 {uptime % 3600 // 60} 分钟）"]
+        if metrics.counters:
+            result_lines.append("计数:")
+            for (name, labels), value in sorted(metrics.counters.items()):
+                label_str = ','.join(f"{k}={v}" for k, v in labels)
+                result_lines.append(f"  {name}{'[' + label_str + ']' if label_str else ''}: {value:g}")
+        if metrics.histograms:
+            result_lines.append("耗时 (次数 / 平均 / p50 / p95 / p99 / 最大):")
+            for (name, labels), histogram in sorted(metrics.histograms.items()):
+                label_str = ','.join(f"{k}={v}" for k, v in labels)
+                count = histogram['count']
+                result_lines.append(
+                    f"  {name}{'[' + label_str + ']' if label_str else ''}: {count} / "
+                    f"{self.format_seconds(histogram['sum'] / count)} / "
+                    f"{self.format_seconds(metrics.quantile(histogram, 0.5))} / "
+                    f"{self.format_seconds(metrics.quantile(histogram, 0.95))} / "
+                    f"{self.format_seconds(metrics.quantile(histogram, 0.99))} / "
+                    f"{self.format_seconds(histogram['max'])}"
+                )
+        if len(result_lines) == 1:
+            result_lines.append("暂无统计数据")
+        yield event.plain_result("\n".join(result_lines))
+
+    def write_metrics_file(self, text):
+        temp_file = self.metrics_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_file, self.metrics_file)
+
+    async def metrics_dump_task(self):
+        while not self.stopping:
+            try:
+                await asyncio.to_thread(self.write_metrics_file, self.metrics.to_prometheus())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"导出统计数据失败: {e}")
+            await asyncio.sleep(self.metrics_dump_interval)
+
+    def get_now(self):
+        return datetime.datetime.fromtimestamp(self.clock(), self.user_custom_timezone)
+
+    def get_fire_time(self, time_str, after):
+        try:
+            target_hour, target_minute = map(int, time_str.split(':'))
+        except (AttributeError, ValueError):
+            return None
+        target_time = after.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)
+        if target_time <= after:
+            target_time = target_time + datetime.timedelta(days=1)
+        return target_time
+
+    def push_schedule(self, group_id, fire_time):
+        fire_ts = fire_time.timestamp()
+        self.next_fire[group_id] = fire_ts
+        heapq.heappush(self.schedule_heap, (fire_ts, next(self.heap_seq), group_id))
+
+    def reschedule_group(self, group_id, wake=True):
+        schedule_info = self.group_schedules.get(group_id) or {}
+        time_str = schedule_info.get('time')
+        if group_id in self.group_schedules:
+            self.task_registry.update(group_id, time_str, bool(schedule_info.get('target')))
+        else:
+            self.task_registry.remove(group_id)
+        next_fire = None
+        if time_str and schedule_info.get('target'):
+            # 当前这一分钟内设置的时间仍视为今日有效，与原先按分钟比对的行为一致
+            now = self.get_now()
+            minute_start = now.replace(second=0, microsecond=0) - datetime.timedelta(microseconds=1)
+            next_fire = self.get_fire_time(time_str, minute_start)
+        if next_fire is None:
+            self.next_fire.pop(group_id, None)
+        else:
+            self.push_schedule(group_id, next_fire)
+        # 失效条目惰性删除，堆膨胀过多时整体压缩
+        if len(self.schedule_heap) > 2 * len(self.next_fire) + 64:
+            self.schedule_heap = [(ts, seq, gid) for ts, seq, gid in self.schedule_heap
+                                   if self.next_fire.get(gid) == ts]
+            heapq.heapify(self.schedule_heap)
+        if wake:
+            self.notify_schedule_changed()
+
+    def notify_schedule_changed(self):
+        self.schedule_changed.set()
+        self.prefetch_wakeup.set()
+
+    def rebuild_schedule_heap(self):
+        self.schedule_heap = []
+        self.next_fire = {}
+        for group_id in list(self.group_schedules):
+            self.reschedule_group(group_id, wake=False)
+        self.notify_schedule_changed()
+
+    def pop_due_groups(self):
+        now_ts = self.clock()
+        groups_to_send = []
+        while self.schedule_heap and self.schedule_heap[0][0] <= now_ts:
+            fire_ts, _, group_id = heapq.heappop(self.schedule_heap)
+            if self.next_fire.get(group_id) != fire_ts:
+                continue
+            schedule_info = self.group_schedules.get(group_id) or {}
             time_str = schedule_info.get('time')
             target = schedule_info.get('target')
-            
-            if time_str:
-                next_send_time = self.get_next_send_time(time_str)
-                task_info = {
-                    'group_id': group_id,
-                    'time': time_str,
-                    'next_send': next_send_time
-                }
-                
-                if target:
-                    active_tasks.append(task_info)
-                else:
-                    inactive_tasks.append(task_info)
-                    inactive_group_ids.append(group_id)
-        
-        if not inactive_tasks:
-            yield event.plain_result("当前没有未激活的定时任务")
+            fire_time = datetime.datetime.fromtimestamp(fire_ts, self.user_custom_timezone)
+            next_fire = self.get_fire_time(time_str, fire_time) if target else None
+            if next_fire is None:
+                self.next_fire.pop(group_id, None)
+                continue
+            self.push_schedule(group_id, next_fire)
+            if not self.is_shard_owner(group_id):
+                continue
+            groups_to_send.append((group_id, target, time_str, fire_ts))
+            logger.info(f"群组 {group_id} 时间已到 ({time_str})，准备发送")
+        return groups_to_send
+
+    async def wait_schedule_change(self, timeout, event=None):
+        event = event or self.schedule_changed
+        # wait_for 在内部等待恰好完成时会吞掉取消，这里用 asyncio.wait 保证 terminate 能结束循环
+        waiter = asyncio.ensure_future(event.wait())
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        finally:
+            waiter.cancel()
+
+    def peek_next_fire(self):
+        while self.schedule_heap:
+            fire_ts, _, group_id = self.schedule_heap[0]
+            if self.next_fire.get(group_id) == fire_ts:
+                return fire_ts
+            heapq.heappop(self.schedule_heap)
+        return None
+
+    def is_image_warm(self, fire_ts):
+        fire_day = datetime.datetime.fromtimestamp(fire_ts, self.user_custom_timezone).date().isoformat()
+        entry = self.image_cache.get(fire_day)
+        if not entry or not os.path.exists(os.path.join(self.cache_dir, entry['file'])):
+            return False
+        # 与 is_cache_fresh 使用同一有效期：发送时缓存仍有效，就不需要再访问上游
+        return fire_ts - entry.get('checked_at', 0) < self.cache_revalidate_seconds
+
+    async def prefetch_task(self):
+        if not self.prefetch_lead_seconds:
             return
-        
-        valid_start = len(active_tasks) + 1
-        valid_end = len(active_tasks) + len(inactive_tasks)
-        valid_list = list(range(valid_start, valid_end + 1))
-        
-        if task_index < valid_start or task_index > valid_end:
-            yield event.plain_result(f"序号 {task_index} 无效。未激活任务序号为 {valid_start}～{valid_end}，可选: {', '.join(map(str, valid_list))}")
+        while not self.stopping:
+            self.prefetch_wakeup.clear()
+            try:
+                fire_ts = self.peek_next_fire() if self.enabled else None
+                if fire_ts is None:
+                    self.warm_state = {'status': 'idle', 'fire_ts': None, 'attempts': 0, 'error': None}
+                    await self.wait_schedule_change(3600, self.prefetch_wakeup)
+                    continue
+                if self.warm_state.get('fire_ts') != fire_ts:
+                    self.warm_state = {'status': 'waiting', 'fire_ts': fire_ts, 'attempts': 0, 'error': None}
+                now_ts = self.clock()
+                if self.is_image_warm(fire_ts):
+                    self.warm_state['status'] = 'ready'
+                    await self.wait_schedule_change(max(fire_ts - now_ts, 0) + 1, self.prefetch_wakeup)
+                    continue
+                # 不跨日预取，否则图片会按前一天的日期缓存
+                fire_time = datetime.datetime.fromtimestamp(fire_ts, self.user_custom_timezone)
+                day_start_ts = fire_time.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+                warm_ts = max(fire_ts - self.prefetch_lead_seconds, day_start_ts)
+                if now_ts < warm_ts:
+                    self.warm_state['status'] = 'waiting'
+                    await self.wait_schedule_change(min(warm_ts - now_ts, 3600), self.prefetch_wakeup)
+                    continue
+                self.warm_state['status'] = 'fetching'
+                self.warm_state['attempts'] += 1
+                image_path = await self.get_zxs_image()
+                if image_path and self.is_image_warm(fire_ts):
+                    self.warm_state.update(status='ready', error=None)
+                    logger.info(f"今日简报图片已预取，距下一批次发送还有 {max(fire_ts - self.clock(), 0):.0f} 秒")
+                    continue
+                retry_delay = min(5 * 2 ** (self.warm_state['attempts'] - 1), 60)
+                self.warm_state.update(status='failed', error="获取今日简报图片失败")
+                logger.error(f"预取今日简报图片失败，{retry_delay} 秒后重试（第 {self.warm_state['attempts']} 次）")
+                await self.wait_schedule_change(retry_delay, self.prefetch_wakeup)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"预取任务出错: {str(e)}")
+                await asyncio.sleep(60)
+
+    def get_warm_state_text(self):
+        fire_ts = self.warm_state.get('fire_ts')
+        if not self.prefetch_lead_seconds or fire_ts is None:
+            return None
+        fire_str = datetime.datetime.fromtimestamp(fire_ts, self.user_custom_timezone).strftime("%Y-%m-%d %H:%M:%S")
+        status = self.warm_state.get('status')
+        if status == 'ready':
+            state_str = "已就绪"
+        elif status == 'fetching':
+            state_str = "预取中"
+        elif status == 'failed':
+            state_str = f"预取失败，后台重试中（已尝试 {self.warm_state.get('attempts', 0)} 次）"
+        else:
+            warm_str = datetime.datetime.fromtimestamp(fire_ts - self.prefetch_lead_seconds, self.user_custom_timezone).strftime("%H:%M:%S")
+            state_str = f"等待预取（约 {warm_str} 开始）"
+        return f"📦 下一批次 {fire_str}，简报图片: {state_str}"
+
+    def parse_platform_rates(self, items):
+        rates = {}
+        for item in items or []:
+            try:
+                platform, rate = str(item).split('=', 1)
+                rates[platform.strip()] = float(rate)
+            except ValueError:
+                logger.error(f"平台限速配置格式错误，应为 平台名=每秒条数: {item}")
+        return rates
+
+    def get_platform_name(self, target):
+        return str(target).split(':', 1)[0]
+
+    def get_rate_limiter(self, platform):
+        limiter = self.rate_limiters.get(platform)
+        if limiter is None:
+            rate = self.platform_send_rates.get(platform, self.send_rate)
+            limiter = TokenBucket(rate, self.send_burst)
+            self.rate_limiters[platform] = limiter
+        return limiter
+
+    async def send_once(self, group_id, target, message_chain):
+        platform = self.get_platform_name(target)
+        limiter = self.get_rate_limiter(platform)
+        # 先取平台令牌再占并发名额，限速较慢的平台排队时不会占满名额拖慢其他平台
+        await limiter.acquire()
+        async with self.send_semaphore:
+            send_start = time.perf_counter()
+            try:
+                await self.context.send_message(target, message_chain)
+            except Exception as e:
+                self.metrics.observe('send_seconds', time.perf_counter() - send_start, {'platform': platform})
+                self.metrics.inc('sends_total', {'platform': platform, 'result': 'error'})
+                logger.error(f"群组 {group_id} 发送消息失败: {str(e)}")
+                return False, str(e)
+            self.metrics.observe('send_seconds', time.perf_counter() - send_start, {'platform': platform})
+            self.metrics.inc('sends_total', {'platform': platform, 'result': 'ok'})
+            return True, None
+
+    async def send_with_limits(self, group_id, target, message_chain, slot=None):
+        # 定时发送只尝试一次，失败交给重试队列，健康的群组不会等待失败的群组
+        sent, error = await self.send_once(group_id, target, message_chain)
+        if sent:
+            if slot is not None:
+                self.metrics.observe('fire_lag_seconds', max(self.clock() - slot[2], 0))
+            logger.info(f"群组 {group_id} 今日简报发送成功")
+        if slot is not None:
+            await self.record_delivery(group_id, slot, 'sent' if sent else 'retrying', 1)
+            if not sent:
+                await self.enqueue_retry(group_id, target, slot[0], 'scheduled', slot[1], 1, error)
+        return sent
+
+    def get_retry_delay(self, attempts):
+        delay = min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def enqueue_retry(self, group_id, target, day, kind, time_str, attempts, error):
+        next_at = self.clock() + self.get_retry_delay(attempts)
+        try:
+            await self.schedule_store.submit(
+                self.schedule_store.enqueue_retry, group_id, day, kind, self.get_origin_str(target),
+                time_str, attempts, next_at, error
+            )
+        except Exception as e:
+            logger.error(f"群组 {group_id} 加入重试队列失败: {e}")
+            return
+        self.metrics.inc('retries_enqueued_total', {'kind': kind})
+        self.retry_wakeup.set()
+
+    def get_retry_deadline(self, day, time_str, created_at):
+        # 定时发送从原定时间点起算，跨零点的时间点（如 23:59 失败）同样有完整的重试期限；手动发送从入队时起算
+        start_ts = created_at
+        if time_str:
+            try:
+                slot_time = datetime.datetime.combine(
+                    datetime.date.fromisoformat(day), datetime.time.fromisoformat(time_str), self.user_custom_timezone
+                )
+                start_ts = slot_time.timestamp()
+            except ValueError:
+                pass
+        return start_ts + self.retry_horizon_seconds
+
+    async def process_retry(self, item, image_path, stale_day):
+        group_id, day, kind, origin, time_str, attempts, last_error, created_at = item
+        slot = (day, time_str, None)
+        if kind == 'scheduled' and (not self.enabled or not (self.group_schedules.get(group_id) or {}).get('target')):
+            # 定时任务已被取消/删除，或全局关闭了定时任务，不再补发
+            logger.info(f"群组 {group_id} 的定时任务已取消或已全局关闭，放弃重试")
+            await self.schedule_store.submit(self.schedule_store.delete_retry, group_id, day, kind)
+            await self.record_delivery(group_id, slot, 'cancelled', 0)
+            return
+        if self.clock() > self.get_retry_deadline(day, time_str, created_at):
+            await self.schedule_store.submit(
+                self.schedule_store.move_to_dead_letter, group_id, day, kind, origin, time_str, attempts, "已超过重试期限，不再重试"
+            )
+            if kind == 'scheduled':
+                await self.record_delivery(group_id, slot, 'dead', 0)
+            self.metrics.inc('dead_letters_total', {'kind': kind})
+            return
+        error = last_error
+        sent = False
+        if image_path:
+            message_chain = await self.get_media_chain(image_path, self.get_platform_name(origin))
+            stale_notice = self.get_stale_notice(stale_day)
+            if stale_notice:
+                message_chain = MessageChain([Plain(stale_notice)] + message_chain.chain)
+            self.metrics.inc('send_retries_total', {'platform': self.get_platform_name(origin)})
+            sent, error = await self.send_once(group_id, origin, message_chain)
+        else:
+            error = "获取今日简报图片失败"
+        attempts += 1
+        if sent:
+            logger.info(f"群组 {group_id} 今日简报重试发送成功（第 {attempts} 次尝试）")
+            await self.schedule_store.submit(self.schedule_store.delete_retry, group_id, day, kind)
+            if kind == 'scheduled':
+                await self.record_delivery(group_id, slot, 'sent', 1)
+        elif attempts >= self.retry_max_attempts:
+            logger.error(f"群组 {group_id} 重试 {attempts} 次仍失败，已移入死信列表: {error}")
+            await self.schedule_store.submit(
+                self.schedule_store.move_to_dead_letter, group_id, day, kind, origin, time_str, attempts, error
+            )
+            if kind == 'scheduled':
+                await self.record_delivery(group_id, slot, 'dead', 1)
+            self.metrics.inc('dead_letters_total', {'kind': kind})
+        else:
+            await self.enqueue_retry(group_id, origin, day, kind, time_str, attempts, error)
+            if kind == 'scheduled':
+                await self.record_delivery(group_id, slot, 'retrying', 1)
+
+    async def retry_worker(self):
+        while not self.stopping:
+            self.retry_wakeup.clear()
+            try:
+                now = self.clock()
+                items, due_count = await self.schedule_store.submit(
+                    self.schedule_store.claim_due_retries, now, 200, now + self.lease_ttl, self.is_shard_owner,
+                    self.node_id, time.time() - self.lease_ttl
+                )
+                if items:
+                    image_path, stale_day = await self.get_zxs_image_info()
+                    await asyncio.gather(
+                        *(self.process_retry(item, image_path, stale_day) for item in items),
+                        return_exceptions=True
+                    )
+                    # 处理出错仍留在队列中的条目不再续约，租约到期后重新领取
+                    await self.schedule_store.submit(self.schedule_store.release_retries, self.node_id)
+                    continue
+                next_at = await self.schedule_store.submit(self.schedule_store.get_next_retry_at)
+                timeout = None if next_at is None else min(max(next_at - self.clock(), 0), 3600)
+                if due_count:
+                    # 到期条目都属于其他节点，等待对方处理或分片变化
+                    timeout = self.lease_ttl / 3
+                await self.wait_schedule_change(timeout, self.retry_wakeup)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"重试队列处理出错: {str(e)}")
+                await asyncio.sleep(60)
+
+    async def dispatch_message(self, targets, message_chains):
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(self.send_with_limits(group_id, target, message_chains[self.get_platform_name(target)], slot)
+              for group_id, target, slot in targets),
+            return_exceptions=True
+        )
+        makespan = time.perf_counter() - start
+        success_count = sum(1 for result in results if result is True)
+        self.metrics.observe('batch_makespan_seconds', makespan)
+        self.metrics.inc('batches_total')
+        logger.info(f"本批次共 {len(targets)} 个群组，成功 {success_count} 个，失败 {len(targets) - success_count} 个，耗时 {makespan:.2f} 秒")
+        return results, makespan
+
+    async def record_delivery(self, group_id, slot, status, attempts):
+        day, time_str, fire_ts = slot
+        try:
+            await self.schedule_store.submit(self.schedule_store.record_delivery, group_id, day, time_str, status, attempts)
+        except Exception as e:
+            logger.error(f"记录群组 {group_id} 的发送结果失败: {e}")
+
+    async def prune_delivery_ledger(self, today):
+        if self.ledger_pruned_day == today:
+            return
+        self.ledger_pruned_day = today
+        before_day = (datetime.date.fromisoformat(today) - datetime.timedelta(days=self.ledger_retention_days)).isoformat()
+        try:
+            removed = await self.schedule_store.submit(self.schedule_store.prune_deliveries, before_day)
+            if removed:
+                logger.info(f"已清理 {removed} 条 {before_day} 之前的发送记录")
+        except Exception as e:
+            logger.error(f"清理发送记录失败: {e}")
+
+    async def send_to_groups(self, groups_to_send):
+        # 同一群组同一天只发送一次：跳过已成功发送或正在发送的群组
+        slots = {}
+        for group_id, target, time_str, fire_ts in groups_to_send:
+            day = datetime.datetime.fromtimestamp(fire_ts, self.user_custom_timezone).date().isoformat()
+            slots.setdefault(day, []).append((group_id, target, time_str, fire_ts))
+        targets = []
+        for day, groups in slots.items():
+            await self.prune_delivery_ledger(day)
+            try:
+                delivered = await self.schedule_store.submit(self.schedule_store.get_delivered_groups, day)
+            except Exception as e:
+                logger.error(f"读取发送记录失败: {e}")
+                delivered = set()
+            pending = []
+            for group_id, target, time_str, fire_ts in groups:
+                if group_id in delivered or (group_id, day) in self.inflight_deliveries:
+                    logger.info(f"群组 {group_id} 今日简报已发送，跳过")
+                    continue
+                pending.append((group_id, target, (day, time_str, fire_ts)))
+            if self.cluster_mode and pending:
+                pending = await self.claim_targets(day, pending)
+            targets.extend(pending)
+        if not targets:
             return
         
-        inactive_index = task_index - valid_start
-        group_id_to_activate = inactive_group_ids[inactive_index]
-        
-        if group_id_to_activate in self.group_schedules:
-            current_group_id = self.get_group_id(event.unified_msg_origin)
-            time_str = self.group_schedules[group_id_to_activate]['time']
+        logger.info(f"检测到 {len(targets)} 个群组需要发送今日简报")
+        keys = [(group_id, slot[0]) for group_id, target, slot in targets]
+        self.inflight_deliveries.update(keys)
+        try:
+            image_path, stale_day = await self.get_zxs_image_info()
             
-            origin_str = self.get_origin_str(event.unified_msg_origin)
-            if group_id_to_activate != current_group_id:
-                self.group_schedules[current_group_id] = {
-                    'time': time_str,
-                    'target': event.unified_msg_origin,
-                    'origin': origin_str
-                }
-                del self.group_schedules[group_id_to_activate]
-            else:
-                self.group_schedules[group_id_to_activate]['target'] = event.unified_msg_origin
-                self.group_schedules[group_id_to_activate]['origin'] = origin_str
+            if not image_path:
+                logger.error("获取今日简报图片失败，本批次已加入重试队列")
+                for group_id, target, slot in targets:
+                    await self.record_delivery(group_id, slot, 'retrying', 0)
+                    await self.enqueue_retry(group_id, target, slot[0], 'scheduled', slot[1], 0, "获取今日简报图片失败")
+                return
             
-            self.save_schedule()
-            yield event.plain_result(f"已激活序号 {task_index} 的定时任务: {time_str}")
-        else:
-            yield event.plain_result(f"激活失败，任务不存在")
+            message_chains = {}
+            for group_id, target, slot in targets:
+                platform = self.get_platform_name(target)
+                if platform not in message_chains:
+                    message_chains[platform] = await self.get_media_chain(image_path, platform)
+            stale_notice = self.get_stale_notice(stale_day)
+            if stale_notice:
+                message_chains = {
+                    platform: MessageChain([Plain(stale_notice)] + message_chain.chain)
+                    for platform, message_chain in message_chains.items()
+                }
+            await self.dispatch_message(targets, message_chains)
+        finally:
+            self.inflight_deliveries.difference_update(keys)
+
+    async def catch_up_missed(self, include_current=False):
+        if not self.enabled or not self.catchup_grace_seconds:
+            return
+        now = self.get_now()
+        today = now.date().isoformat()
+        # 当前这一分钟由调度器负责，这里只补发停机期间错过、且仍在宽限时间内的时间点；
+        # 接管其他节点的分片时，对方可能已错过当前这一分钟，一并补发
+        minute_start = now.replace(second=0, microsecond=0)
+        if include_current:
+            minute_start += datetime.timedelta(minutes=1)
+        groups_to_send = []
+        for group_id, schedule_info in list(self.group_schedules.items()):
+            time_str = schedule_info.get('time')
+            target = schedule_info.get('target')
+            if not time_str or not target or not self.is_shard_owner(group_id):
+                continue
+            try:
+                target_hour, target_minute = map(int, time_str.split(':'))
+            except ValueError:
+                continue
+            slot_time = now.replace(hour=target_hour, minute=target_minute, second=0, microsecond=0)
+            if slot_time >= minute_start:
+                # 今天的时间点还没到时检查前一天的，跨零点错过的任务（如 23:50 错过、00:05 重启）按前一天记账
+                slot_time -= datetime.timedelta(days=1)
+            if (now - slot_time).total_seconds() <= self.catchup_grace_seconds:
+                groups_to_send.append((group_id, target, time_str, slot_time.timestamp()))
+        if not groups_to_send:
+            await self.prune_delivery_ledger(today)
+            return
+        logger.info(f"检查 {len(groups_to_send)} 个在宽限时间内错过的定时任务")
+        self.start_dispatch(groups_to_send)
+
+    async def claim_targets(self, day, targets):
+        now = time.time()
+        try:
+            claimed = await self.schedule_store.submit(
+                self.schedule_store.claim_deliveries, day, [(group_id, slot[1]) for group_id, target, slot in targets],
+                self.node_id, now, now + self.lease_ttl, now - self.lease_ttl
+            )
+        except Exception as e:
+            logger.error(f"领取发送任务失败: {e}")
+            return []
+        if len(claimed) < len(targets):
+            logger.info(f"{len(targets) - len(claimed)} 个群组已由其他节点处理，跳过")
+        return [item for item in targets if item[0] in claimed]
+
+    def is_shard_owner(self, group_id):
+        return not self.cluster_mode or self.shard_ring.get_node(group_id) == self.node_id
 
+    async def update_cluster(self):
+        live_nodes, revision = await self.schedule_store.submit(
+            self.schedule_store.heartbeat, self.node_id, time.time(), self.lease_ttl
+        )
+        changed = sorted(set(live_nodes)) != self.shard_ring.nodes
+        if changed:
+            self.shard_ring = HashRing(live_nodes)
+            logger.info(f"集群节点变化，当前存活 {len(self.shard_ring.nodes)} 个节点: {', '.join(self.shard_ring.nodes)}")
+        reload = self.schedule_revision is not None and revision != self.schedule_revision
+        self.schedule_revision = revision
+        return changed, reload
+
+    async def cluster_task(self):
+        interval = max(self.lease_ttl / 3, 1)
+        while not self.stopping:
+            await asyncio.sleep(interval)
+            try:
+                changed, reload = await self.update_cluster()
+                if reload:
+                    logger.info("检测到其他节点修改了定时任务，重新加载")
+                    await self.load_schedule()
+                if changed:
+                    # 接管的分片中可能有刚错过的时间点，领取机制保证不会与原节点重复发送
+                    self.start_background(self.catch_up_missed(include_current=True))
+                    self.retry_wakeup.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"集群心跳出错: {str(e)}")
+
+    def start_dispatch(self, groups_to_send):
+        # 批次在独立任务中发送，调度循环不会被慢群组阻塞
+        task = asyncio.get_running_loop().create_task(self.send_to_groups(groups_to_send))
+        self.dispatch_tasks.add(task)
+        task.add_done_callback(self.dispatch_tasks.discard)
+        return task
 
     async def scheduled_task(self):
-        if not self.enabled:
-            return
         logger.info("定时任务开始执行，支持多群组独立时间设置")
-        group_last_executed = {}
-        while True:
+        while not self.stopping:
+            # 先清除信号再取到期任务，处理期间的修改会让下一次等待立即返回
+            self.schedule_changed.clear()
             if not self.enabled:
-                await asyncio.sleep(60)
+                await self.wait_schedule_change(60)
                 continue
             try:
-                now = datetime.datetime.now(self.user_custom_timezone)
-                groups_to_send = []
-                for group_id, schedule_info in self.group_schedules.items():
-                    time_str = schedule_info.get('time')
-                    target = schedule_info.get('target')
-                    
-                    if not time_str or not target:
-                        continue
-                    
-                    try:
-                        target_hour, target_minute = map(int, time_str.split(':'))
-                        if now.hour == target_hour and now.minute == target_minute:
-                            today_key = f"{group_id}_{now.date()}"
-                            last_executed = group_last_executed.get(today_key)
-                            
-                            if last_executed is None or last_executed.date() != now.date():
-                                groups_to_send.append((group_id, target, time_str))
-                                logger.info(f"群组 {group_id} 时间已到 ({time_str})，准备发送")
-                    except Exception as e:
-                        logger.error(f"处理群组 {group_id} 的时间设置时出错: {e}")
-                        continue
-                
+                groups_to_send = self.pop_due_groups()
                 if groups_to_send:
-                    logger.info(f"检测到 {len(groups_to_send)} 个群组需要发送今日简报")
-                    image_path = await self.get_zxs_image()
-                    
-                    if image_path:
-                        for group_id, target, time_str in groups_to_send:
-                            try:
-                                if os.path.exists(image_path):
-                                    message_chain = MessageChain([
-                                        Image.fromFileSystem(image_path)
-                                    ])
-                                else:
-                                    message_chain = MessageChain([
-                                        Image.fromURL(image_path)
-                                    ])
-                                
-                                max_retries = 3
-                                sent = False
-                                for retry in range(max_retries):
-                                    try:
-                                        await self.context.send_message(target, message_chain)
-                                        logger.info(f"群组 {group_id} 今日简报发送成功")
-                                        today_key = f"{group_id}_{now.date()}"
-                                        group_last_executed[today_key] = now
-                                        sent = True
-                                        break
-                                    except Exception as e:
-                                        if retry < max_retries - 1:
-                                            logger.error(f"群组 {group_id} 发送消息失败，第 {retry + 1} 次重试: {str(e)}")
-                                            await asyncio.sleep(2)
-                                        else:
-                                            logger.error(f"群组 {group_id} 定时发送消息失败: {str(e)}")
-                                
-                                if not sent:
-                                    logger.error(f"群组 {group_id} 发送失败，已达到最大重试次数")
-                            except Exception as e:
-                                logger.error(f"为群组 {group_id} 发送消息时出错: {e}")
-                    else:
-                        logger.error("获取今日简报图片失败，跳过本次发送")
+                    self.start_dispatch(groups_to_send)
                 
-                await asyncio.sleep(60)
+                timeout = None
+                if self.schedule_heap:
+                    # 最长一小时校准一次，防止系统时间跳变导致长时间睡过头
+                    timeout = min(max(self.schedule_heap[0][0] - self.clock(), 0), 3600)
+                await self.wait_schedule_change(timeout)
             except Exception as e:
                 logger.error(f"定时任务出错: {str(e)}")
                 import traceback
                 logger.error(traceback.format_exc())
                 await asyncio.sleep(60)
-